@@ -0,0 +1,55 @@
+"""Connection to ES, shared by the notebooks in this directory and in rc1
+(through their util modules).
+"""
+
+import certifi
+import configparser
+import os
+
+from elasticsearch import Elasticsearch
+
+# ES clients already built, by settings
+_es_connections = {}
+
+def ESConnection(settings_path='.settings'):
+    """Returns an ES client built from the settings file.
+
+    Clients are cached for the whole process (one per settings file and
+    values), so that all callers share the same pool of keep-alive
+    connections. Besides connection data, the [ElasticSearch] section
+    may include (defaults in parenthesis):
+      - maxsize: max number of connections in the pool (25)
+      - http_compress: gzip-compress requests and responses (yes)
+      - timeout: default timeout for each request, in seconds (1000)
+      - retry_on_timeout: retry a request if it timed out (no)
+      - max_retries: max number of retries for a request (3)
+    """
+
+    parser = configparser.ConfigParser()
+    parser.read(settings_path)
+
+    section = parser['ElasticSearch']
+    cache_key = (os.path.abspath(settings_path), tuple(sorted(section.items())))
+    if cache_key in _es_connections:
+        return _es_connections[cache_key]
+
+    user = section['user']
+    password = section['password']
+    host = section['host']
+    port = section['port']
+    path = section['path']
+
+    connection = "https://" + user + ":" + password + "@" + host + ":" + port \
+                + "/" + path
+
+    es_read = Elasticsearch([connection], use_ssl=True, verity_certs=True,
+        ca_cert=certifi.where(), scroll='300m',
+        timeout=section.getint('timeout', fallback=1000),
+        maxsize=section.getint('maxsize', fallback=25),
+        http_compress=section.getboolean('http_compress', fallback=True),
+        retry_on_timeout=section.getboolean('retry_on_timeout',
+                                            fallback=False),
+        max_retries=section.getint('max_retries', fallback=3))
+
+    _es_connections[cache_key] = es_read
+    return es_read
@@ -0,0 +1,169 @@
+"""On-disk cache for results of ES searches, shared by the notebooks
+in this directory and in rc1 (through their util modules).
+"""
+
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import time
+
+from elasticsearch_dsl.response import Response
+
+# On-disk cache for query results
+CACHE_PATH = '.cache'
+CACHE_TTL = 7 * 24 * 3600
+CACHE_MAX_SIZE = 1024 * 1024 * 1024
+# Temporary files older than this (seconds) are from failed writers
+TMP_TTL = 3600
+
+class QueryCache():
+    """Persistent on-disk cache for results of ES searches.
+
+    Results are stored gzip-compressed in path, one file per search,
+    keyed by a hash of the search body, its index and the ES cluster.
+    Entries older than ttl seconds are not used, and least recently
+    used ones are evicted when the cache grows over max_size bytes.
+
+    """
+
+    def __init__(self, path=CACHE_PATH, ttl=CACHE_TTL,
+                 max_size=CACHE_MAX_SIZE):
+        """Constructor.
+
+        :param path: directory for the cache files
+        :param ttl: seconds a result is valid (None for no expiration)
+        :param max_size: max size of the cache, in bytes
+        """
+        self.path = path
+        self.ttl = ttl
+        self.max_size = max_size
+
+    def _key(self, s):
+        """Hash identifying the search body, index and cluster of s.
+        """
+        es = s._using
+        cluster = getattr(getattr(es, 'transport', None), 'hosts', es)
+        key = json.dumps({'body': s.to_dict(),
+                          'index': s._index,
+                          'cluster': repr(cluster)},
+                         sort_keys=True, default=str)
+        return hashlib.sha1(key.encode('utf-8')).hexdigest()
+
+    def _filepath(self, s):
+        return os.path.join(self.path, self._key(s) + '.json.gz')
+
+    def get(self, s):
+        """Returns the cached result for s, or None if not available.
+        """
+        filepath = self._filepath(s)
+        try:
+            with gzip.open(filepath, 'rt') as f:
+                entry = json.load(f)
+        except (OSError, ValueError):
+            return None
+
+        if self.ttl is not None and time.time() - entry['created'] > self.ttl:
+            self._remove(filepath)
+            return None
+
+        # Modification time tracks last use, for LRU eviction
+        try:
+            os.utime(filepath)
+        except FileNotFoundError:
+            # Expired or evicted meanwhile (by another thread or process)
+            return None
+        return Response(s, entry['response'])
+
+    def put(self, s, result):
+        """Stores result as the cached result for s.
+        """
+        os.makedirs(self.path, exist_ok=True)
+        filepath = self._filepath(s)
+        # Unique temporary file, in case of concurrent writers
+        fd, tmp_filepath = tempfile.mkstemp(dir=self.path, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as raw, gzip.open(raw, 'wt') as f:
+                json.dump({'created': time.time(),
+                           'response': result.to_dict()}, f)
+            os.replace(tmp_filepath, filepath)
+        except BaseException:
+            self._remove(tmp_filepath)
+            raise
+        self._evict()
+
+    def execute(self, s):
+        """Returns the result of s, from the cache if available, running
+        it (and caching the result) if not.
+        """
+        result = self.get(s)
+        if result is None:
+            result = s.execute()
+            self.put(s, result)
+        return result
+
+    def invalidate(self, s=None):
+        """Removes the cached result for s, or all of them if s is None.
+        """
+        if s is not None:
+            self._remove(self._filepath(s))
+            return
+        for filepath in self._entries():
+            self._remove(filepath)
+
+    def _entries(self, suffix='.json.gz'):
+        if not os.path.isdir(self.path):
+            return []
+        return [os.path.join(self.path, name) for name in os.listdir(self.path)
+                if name.endswith(suffix)]
+
+    def _remove(self, filepath):
+        try:
+            os.remove(filepath)
+        except FileNotFoundError:
+            pass
+
+    def _evict(self):
+        """Removes least recently used entries until the cache fits
+        in max_size, and temporary files left by failed writers.
+        """
+        for filepath in self._entries(suffix='.tmp'):
+            try:
+                if time.time() - os.stat(filepath).st_mtime > TMP_TTL:
+                    self._remove(filepath)
+            except FileNotFoundError:
+                pass
+        entries = []
+        for filepath in self._entries():
+            try:
+                stat = os.stat(filepath)
+            except FileNotFoundError:
+                # Removed meanwhile (by another thread or process)
+                continue
+            entries.append((stat.st_mtime, stat.st_size, filepath))
+        size = sum(entry[1] for entry in entries)
+        for _, entry_size, filepath in sorted(entries):
+            if size <= self.max_size:
+                break
+            self._remove(filepath)
+            size -= entry_size
+
+query_cache = QueryCache()
+
+def cached_execute(s, cache=None):
+    """Execute search s, using the on-disk query cache.
+
+    :param s: search to execute
+    :param cache: QueryCache to use (default: query_cache)
+    """
+    if cache is None:
+        cache = query_cache
+    return cache.execute(s)
+
+def invalidate_cache(s=None, cache=None):
+    """Remove the cached result for s (or all cached results if s is None).
+    """
+    if cache is None:
+        cache = query_cache
+    cache.invalidate(s)
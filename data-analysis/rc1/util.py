@@ -1,23 +1,64 @@
 
-import certifi
+from concurrent.futures import ThreadPoolExecutor
 import csv
-import configparser
-from datetime import datetime
+import hashlib
+import os
+import pickle
+import sys
+import tempfile
 
+import numpy as np
 import pandas as pd
 
 import plotly as plotly
 import plotly.figure_factory as ff
 import plotly.graph_objs as go
 
-from elasticsearch import Elasticsearch
-from elasticsearch_dsl import Search
+from elasticsearch_dsl import MultiSearch, Search
+
+# ES connection and query cache are shared with the notebooks in the
+# parent directory
+sys.path.append(os.path.join(os.path.dirname(os.path.abspath(__file__)),
+                             os.pardir))
+import es_connection
+import query_cache
+
+ESConnection = es_connection.ESConnection
+cached_execute = query_cache.cached_execute
+invalidate_cache = query_cache.invalidate_cache
 
 GITHUB_HANDLE = 'github_handle'
 EMAIL = 'email'
 BUGZILLA_EMAIL = 'bugzilla_email'
 UUID = 'uuid'
 
+STAFF_ORG_NAMES = ['Mozilla Staff', 'Code Sheriff']
+
+# Survey questions used to find the uuid of the respondent
+SURVEY_IDENTITY_QUESTIONS = {
+    EMAIL: 'Please provide us with your email',
+    GITHUB_HANDLE: 'Please provide us with your GitHub handle',
+    BUGZILLA_EMAIL: 'Please provide us with your Bugzilla email'
+}
+
+# Survey questions (values) loaded in each survey_df column (keys)
+SURVEY_QUESTIONS = {
+    'active': 'Have you contributed to a Mozilla or related project within the past year? ',
+    'age': 'How old are you? ',
+    'country': 'In which country are you currently based?',
+    'gender': 'With which gender do you identify? ',
+    'disability': 'Do you identify with any of the below statements',
+    'education level': 'What is your current level of education?',
+    'language': 'Which language do you speak most often? ',
+    'english proficiency': 'How would you rate your proficiency in English?',
+    'coding': 'Coding:Please select all the ways in which you have contributed to Mozilla or related projects in the past year (Select all that apply.)'
+}
+
+PROJECTS_FILEPATH = "../data/Contributors and Communities Analysis - Project grouping.xlsx"
+
+# Project groups already loaded, by workbook path: (mtime, groups, repos)
+_loaded_projects = {}
+
 def read_projects(filepath):
     xl = pd.ExcelFile(filepath)
     project_groups = {}
@@ -37,28 +78,71 @@ def normalize_github_handle(handle):
 
     return github_handle
 
-def ESConnection():
-
-    parser = configparser.ConfigParser()
-    parser.read('.settings')
-
-    section = parser['ElasticSearch']
-    user = section['user']
-    password = section['password']
-    host = section['host']
-    port = section['port']
-    path = section['path']
-
-    connection = "https://" + user + ":" + password + "@" + host + ":" + port \
-                + "/" + path
+def _load_projects(filepath):
+    """Load project groups from the workbook in filepath, parsing it only
+    if it changed since the last time.
 
-    es_read = Elasticsearch([connection], use_ssl=True, verity_certs=True,
-    ca_cert=certifi.where(), scroll='300m', timeout=1000)
+    Parsed groups are kept for the rest of the process, and pickled in
+    the cache directory (keyed by workbook modification time), so that
+    new processes don't need to parse the workbook either.
 
-    return es_read
+    :returns: tuple (project groups, list of GitHub repos)
+    """
+    key = os.path.abspath(filepath)
+    mtime = os.path.getmtime(filepath)
+
+    if key in _loaded_projects and _loaded_projects[key][0] == mtime:
+        return _loaded_projects[key][1:]
+
+    pickle_path = os.path.join(query_cache.CACHE_PATH, 'projects-'
+                               + hashlib.sha1(key.encode('utf-8')).hexdigest()
+                               + '.pickle')
+    loaded = None
+    try:
+        with open(pickle_path, 'rb') as f:
+            loaded = pickle.load(f)
+        if loaded[0] != mtime:
+            loaded = None
+    except Exception:
+        # Missing, truncated, or pickled by other Python / pandas versions
+        # (which may fail in many ways): just parse the workbook again
+        loaded = None
+
+    if loaded is None:
+        project_groups = read_projects(filepath)
+        repos = project_groups['Github']['Repo'].tolist()
+        loaded = (mtime, project_groups, repos)
+        os.makedirs(query_cache.CACHE_PATH, exist_ok=True)
+        # Unique temporary file, in case of concurrent notebook processes
+        fd, tmp_path = tempfile.mkstemp(dir=query_cache.CACHE_PATH,
+                                        suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as f:
+                pickle.dump(loaded, f, protocol=pickle.HIGHEST_PROTOCOL)
+            os.replace(tmp_path, pickle_path)
+        except BaseException:
+            try:
+                os.remove(tmp_path)
+            except OSError:
+                pass
+            raise
+
+    _loaded_projects[key] = loaded
+    return loaded[1:]
+
+def get_projects(filepath=PROJECTS_FILEPATH):
+    """Returns project groups from the REVIEWED SPREADSHEET (a copy,
+    so that it can be safely modified).
+    """
+    project_groups, _ = _load_projects(filepath)
+    return {name: df.copy() for name, df in project_groups.items()}
 
-def get_projects():
-    return read_projects("../data/Contributors and Communities Analysis - Project grouping.xlsx")
+def get_github_repos(filepath=PROJECTS_FILEPATH):
+    """Returns the list of GitHub repos (with .git) in the REVIEWED
+    SPREADSHEET.
+    """
+    _, repos = _load_projects(filepath)
+    return repos
 
 def parse_csv(filepath):
     """Parse CSV files.
@@ -103,7 +187,7 @@ def add_project_filter(s, project_name):
 def add_survey_filters(s, survey_df):
     s = s.filter('terms', author_uuid=survey_df['uuid'].tolist())
     # EXCLUDE MOZILLA EMPLOYEES
-    s = s.exclude('terms', author_org_name=['Mozilla Staff', 'Code Sheriff'])
+    s = s.exclude('terms', author_org_name=STAFF_ORG_NAMES)
     return s
 
 def create_search(es_conn, source):
@@ -111,14 +195,11 @@ def create_search(es_conn, source):
     given data source using a given connection
     """
 
-    # Let's load projects from the REVIEWED SPREADSHEET
-    projects = get_projects()
-
     s = Search(using=es_conn, index=source)
 
     if source == 'git' or source == 'github':
-        github = projects['Github']
-        repos = github['Repo'].tolist()
+        # Let's load projects from the REVIEWED SPREADSHEET
+        repos = get_github_repos()
         #print (repos)
         s = s.filter('terms', repo_name=repos)
 
@@ -129,6 +210,104 @@ def create_search(es_conn, source):
 
     return s
 
+def run_searches(searches, max_workers=4, execute=None):
+    """Execute several independent searches concurrently.
+
+    Searches are run in a pool of at most max_workers threads, so that
+    total time is close to that of the slowest one.
+
+    :param searches: dictionary with the searches to execute, by name
+    :param max_workers: max number of searches running at the same time
+    :param execute: function to execute each search (eg, cached_execute),
+        by default Search.execute
+    :returns: dictionary with the result of each search, by name
+    """
+    if execute is None:
+        execute = lambda s: s.execute()
+
+    with ThreadPoolExecutor(max_workers=max_workers) as executor:
+        futures = {name: executor.submit(execute, s)
+                   for name, s in searches.items()}
+
+    return {name: future.result() for name, future in futures.items()}
+
+def staff_variants(staff_org_names=STAFF_ORG_NAMES):
+    """Variants of a search for all authors, non-employees and employees,
+    to be used with execute_variants.
+    """
+    return {
+        'all': lambda s: s,
+        'non-employees': lambda s: s.exclude('terms',
+                                             author_org_name=staff_org_names),
+        'employees': lambda s: s.filter('terms',
+                                        author_org_name=staff_org_names)
+    }
+
+def execute_variants(s, variants, to_df=None):
+    """Execute several variants of a search in a single request (_msearch).
+
+    Each variant is produced from s (with its aggregations) by a function,
+    usually adding some filter. Eg, to get commits per project for all
+    authors, non-employees and employees:
+
+        dfs = execute_variants(s, staff_variants(),
+                               to_df=lambda result: stack_by(result, ...))
+
+    :param s: base search
+    :param variants: dictionary with a function producing each variant of s
+    :param to_df: function to build a DataFrame from each result (if None,
+        results are returned as they are)
+    :returns: dictionary with the result (or DataFrame) for each variant
+    """
+    names = list(variants.keys())
+
+    ms = MultiSearch(using=s._using)
+    for name in names:
+        ms = ms.add(variants[name](s))
+    responses = ms.execute()
+
+    results = {}
+    for name, response in zip(names, responses):
+        results[name] = to_df(response) if to_df else response
+
+    return results
+
+def iter_composite(s, sources, metrics=None, size=1000, name='composite'):
+    """Run a bucket tree as a paginated composite aggregation.
+
+    Instead of nested terms aggregations with a huge size, answered in
+    a single response, buckets are requested page by page (following
+    after_key), so that memory is bounded both in ES and in the client.
+
+    :param s: search to run (eg, from create_search), with no aggregations
+    :param sources: list of composite sources, outer first, each of them
+        a dictionary such as {'uuid': A('terms', field='author_uuid')}
+    :param metrics: dictionary with metric aggregations for each bucket
+    :param size: number of buckets per page
+    :param name: name of the composite aggregation
+    :returns: generator of lists of buckets (one list per page)
+    """
+    after = None
+    while True:
+        s_page = s.extra(size=0)
+        params = {'sources': sources, 'size': size}
+        if after is not None:
+            params['after'] = after
+        agg = s_page.aggs.bucket(name, 'composite', **params)
+        if metrics:
+            for metric_name, metric in metrics.items():
+                agg.metric(metric_name, metric)
+
+        result = s_page.execute().to_dict()['aggregations'][name]
+        buckets = result['buckets']
+        if not buckets:
+            break
+        yield buckets
+
+        # after_key is not returned by old ES versions
+        after = result.get('after_key', buckets[-1]['key'])
+
+
 def print_result(result):
     """In case you need to check query response, call this function
     """
@@ -139,56 +318,136 @@ def print_result(result):
 # PANDAS RELATED FUNCTIONS #
 ############################
 
+def _identity_uuids(uuids_df, field):
+    """Series mapping each non-empty value of field to its uuid
+    (the last one, if the value appears more than once).
+    """
+    identities = uuids_df.loc[uuids_df[field] != '', [field, UUID]]
+    identities = identities.drop_duplicates(subset=field, keep='last')
+
+    return identities.set_index(field)[UUID]
+
 def load_survey_df(survey_filepath, uuids_filepath):
 
     # Get UUIDS from correspondences file
-    email_uuid = {}
-    github_uuid = {}
-    bugzilla_uuid = {}
-    for row in parse_csv(uuids_filepath):
-        row_uuid = row[UUID]
-        if row[EMAIL] is not None and row[EMAIL] != '':
-            email_uuid[row[EMAIL]] = row_uuid
-        if row[GITHUB_HANDLE] is not None and row[GITHUB_HANDLE] != '':
-            github_uuid[row[GITHUB_HANDLE]] = row_uuid
-        if row[BUGZILLA_EMAIL] is not None and row[BUGZILLA_EMAIL] != '':
-            bugzilla_uuid[row[BUGZILLA_EMAIL]] = row_uuid
+    uuids_df = pd.read_csv(uuids_filepath, dtype=str, keep_default_na=False,
+                           usecols=[UUID, EMAIL, GITHUB_HANDLE, BUGZILLA_EMAIL])
 
     # Read survey and add corresponding UUIDs
-    survey_df = pd.DataFrame(columns=['uuid', 'active', 'age', 'country', 'gender', 'disability',
-                                      'education level', 'language', 'english proficiency',
-                                      'coding'])
-
-    for row in parse_csv(survey_filepath):
-        github_handle = row['Please provide us with your GitHub handle']
-        github_handle = normalize_github_handle(github_handle)
-        email = row['Please provide us with your email']
-        bugzilla_email = row['Please provide us with your Bugzilla email']
-
-        uuid = None
-        if email in email_uuid:
-            uuid = email_uuid[email]
-        elif github_handle in github_uuid:
-            uuid = github_uuid[github_handle]
-        elif bugzilla_email in bugzilla_uuid:
-            uuid = bugzilla_uuid[bugzilla_email]
-
-        if uuid is not None:
-            active = row['Have you contributed to a Mozilla or related project within the past year? ']
-            age = row['How old are you? ']
-            country = row['In which country are you currently based?']
-            gender = row['With which gender do you identify? ']
-            disability = row['Do you identify with any of the below statements']
-            education_level = row['What is your current level of education?']
-            language = row['Which language do you speak most often? ']
-            english_prof = row['How would you rate your proficiency in English?']
-            coding = row['Coding:Please select all the ways in which you have contributed to Mozilla or related projects in the past year (Select all that apply.)']
-            survey_df.loc[len(survey_df)] = [uuid, active, age, country, gender, disability,
-                                             education_level, language, english_prof, coding]
-        #else:
-        #    print('Not found: ', email, github_handle, bugzilla_email)
-
-    return survey_df
+    survey = pd.read_csv(survey_filepath, dtype=str, keep_default_na=False,
+                         usecols=list(SURVEY_IDENTITY_QUESTIONS.values())
+                                 + list(SURVEY_QUESTIONS.values()))
+
+    github_handle = survey[SURVEY_IDENTITY_QUESTIONS[GITHUB_HANDLE]]\
+                    .str.replace('https://github.com/', '', regex=False)\
+                    .str.replace('/', '', regex=False)\
+                    .str.replace('@', '', regex=False)
+    email = survey[SURVEY_IDENTITY_QUESTIONS[EMAIL]]
+    bugzilla_email = survey[SURVEY_IDENTITY_QUESTIONS[BUGZILLA_EMAIL]]
+
+    # Email first, then GitHub handle, then Bugzilla email
+    uuid = email.map(_identity_uuids(uuids_df, EMAIL))\
+           .fillna(github_handle.map(_identity_uuids(uuids_df, GITHUB_HANDLE)))\
+           .fillna(bugzilla_email.map(_identity_uuids(uuids_df, BUGZILLA_EMAIL)))
+
+    found = uuid.notna()
+    columns = {UUID: uuid[found]}
+    for column, question in SURVEY_QUESTIONS.items():
+        columns[column] = survey.loc[found, question]
+    survey_df = pd.DataFrame(columns, columns=[UUID] + list(SURVEY_QUESTIONS))
+
+    return survey_df.reset_index(drop=True)
+
+def bucket_key(bucket):
+    """Return the key of a bucket, as string if ES provides one
+    (eg, dates in date_histogram buckets).
+    """
+    if 'key_as_string' in bucket:
+        return bucket['key_as_string']
+    return bucket['key']
+
+def bucket_value(bucket, value_field=None):
+    """Return the value of a bucket: the value of the metric value_field
+    if provided, doc_count if not.
+    """
+    if value_field is not None:
+        return bucket[value_field]['value']
+    return bucket['doc_count']
+
+def flatten_buckets(buckets, subgroup_fields=(), value_field=None,
+                    columns=None):
+    """Flatten (maybe nested) aggregation buckets into column lists.
+
+    Walks buckets, descending into subgroup_fields in order, and appends
+    one row per innermost bucket: the keys of every level (outer first)
+    followed by its value.
+
+    :param buckets: list of buckets of the outer aggregation
+    :param subgroup_fields: names of the nested bucket aggregations
+    :param value_field: metric in the innermost buckets (doc_count if None)
+    :param columns: lists to append to (new ones are created if None)
+    :returns: list of columns, one per level plus one for the value
+    """
+    if columns is None:
+        columns = [[] for _ in range(len(subgroup_fields) + 2)]
+
+    # Iterative walk, keeping the keys of the enclosing buckets
+    pending = [(buckets, 0, ())]
+    while pending:
+        level_buckets, level, keys = pending.pop()
+        if level == len(subgroup_fields):
+            for bucket in level_buckets:
+                row = keys + (bucket_key(bucket), bucket_value(bucket, value_field))
+                for column, value in zip(columns, row):
+                    column.append(value)
+        else:
+            subgroup_field = subgroup_fields[level]
+            # Reversed, so that rows keep the order of the buckets
+            for bucket in reversed(level_buckets):
+                pending.append((bucket[subgroup_field]['buckets'], level + 1,
+                                keys + (bucket_key(bucket),)))
+
+    return columns
+
+def buckets_to_df(result, columns, bucket_fields, value_field=None):
+    """Create a DataFrame from an ES result with nested buckets.
+
+    The DataFrame is built at once from the flattened buckets.
+
+    :param result: ES result
+    :param columns: column names, one per bucket field plus the value one
+    :param bucket_fields: names of the nested bucket aggregations, outer first
+    :param value_field: metric in the innermost buckets (doc_count if None)
+    """
+    buckets = result.to_dict()['aggregations'][bucket_fields[0]]['buckets']
+    data = flatten_buckets(buckets, bucket_fields[1:], value_field)
+
+    return pd.DataFrame(dict(zip(columns, data)), columns=columns)
+
+def composite_to_df(s, columns, sources, value_field=None, metrics=None,
+                    size=1000):
+    """Create a DataFrame from a paginated composite aggregation.
+
+    Pages are flattened as they arrive, so only one of them is kept
+    in memory at a time.
+
+    :param s: search to run, with no aggregations
+    :param columns: column names, one per source plus the value one
+    :param sources: composite sources, as in iter_composite
+    :param value_field: metric in the buckets (doc_count if None)
+    :param metrics: dictionary with metric aggregations for each bucket
+    :param size: number of buckets per page
+    """
+    source_names = [list(source.keys())[0] for source in sources]
+    data = [[] for _ in range(len(source_names) + 1)]
+
+    for buckets in iter_composite(s, sources, metrics=metrics, size=size):
+        for bucket in buckets:
+            for column, source_name in zip(data, source_names):
+                column.append(bucket['key'][source_name])
+            data[-1].append(bucket_value(bucket, value_field))
+
+    return pd.DataFrame(dict(zip(columns, data)), columns=columns)
 
 def to_simple_df(result, group_field, value_field, group_column, value_column):
     """Create a DataFrame from an ES result with 1 BUCKET and 1 METRIC.
@@ -209,154 +468,120 @@ def stack_by(result, group_column, subgroup_column, value_column,
     If value_field is provided, then a metric is expected, if not,
     use doc_count as value.
     """
-    df = pd.DataFrame(columns=[group_column, subgroup_column, value_column])
-
-    for group in result.to_dict()['aggregations'][group_field]['buckets']:
-        for subgroup in group[subgroup_field]['buckets']:
-            group_key = group['key']
-            if 'key_as_string' in subgroup:
-                subgroup_key = subgroup['key_as_string']
-            else:
-                subgroup_key = subgroup['key']
-
-            if value_field is not None:
-                value = subgroup[value_field]['value']
-            else:
-                value = subgroup['doc_count']
-
-            df.loc[len(df)] = [group_key,
-                               subgroup_key,
-                               value]
-
-    return df
+    return buckets_to_df(result,
+                         columns=[group_column, subgroup_column, value_column],
+                         bucket_fields=[group_field, subgroup_field],
+                         value_field=value_field)
 
 def stack_by_cusum(result, group_column, subgroup_column, value_column,
                    group_field, subgroup_field,
                    staff_org_names, staff_org,
-                   metric_field=None):
-
-    df = pd.DataFrame(columns=[group_column, subgroup_column, value_column])
-
-    for group in result.to_dict()['aggregations'][group_field]['buckets']:
-        group_key = group['key']
-        if group_key in staff_org_names:
-            group_key = staff_org
-        else:
-            group_key = 'Non-Employees'
-
-        print(group['key'], '->', group_key)
-
-        for subgroup in group[subgroup_field]['buckets']:
-
-            if 'key_as_string' in subgroup:
-                subgroup_key = subgroup['key_as_string']
-            else:
-                subgroup_key = subgroup['key']
-
-            if metric_field is not None:
-                value = subgroup[metric_field]['value']
-            else:
-                value = subgroup['doc_count']
-
-            subgroup_key_list = df[df[group_column] == group_key][subgroup_column]\
-                        .tolist()
-            if group_key in df[group_column].unique() \
-                and subgroup_key in subgroup_key_list:
-
-                df.loc[(df[group_column] == group_key) \
-                        & (df[subgroup_column] == subgroup_key),
-                       value_column] += value
-
-            else:
-                df.loc[len(df)] = [group_key, subgroup_key, value]
-
-    return df
-
-def get_authors_df(result, author_bucket_field):
-
-    # Get a dataframe with each author and their first commit
+                   metric_field=None, verbose=False):
+    """Creates a dataframe based on group and subgroup values, where groups
+    (organizations) are merged into staff_org (those in staff_org_names)
+    and 'Non-Employees' (the rest). Values for the same merged group and
+    subgroup are summed up.
+    """
+    staff_org_names = set(staff_org_names)
+
+    buckets = result.to_dict()['aggregations'][group_field]['buckets']
+    groups, subgroups, values = flatten_buckets(buckets, [subgroup_field],
+                                                metric_field)
+
+    if verbose:
+        for group in buckets:
+            group_key = staff_org if group['key'] in staff_org_names \
+                        else 'Non-Employees'
+            print(group['key'], '->', group_key)
+
+    df = pd.DataFrame({
+        group_column: [staff_org if group in staff_org_names
+                       else 'Non-Employees' for group in groups],
+        subgroup_column: subgroups,
+        value_column: values
+    }, columns=[group_column, subgroup_column, value_column])
+
+    # Keep groups and subgroups in order of first appearance
+    return df.groupby([group_column, subgroup_column], sort=False,
+                      as_index=False)[value_column].sum()
+
+def _authors_df(result, author_bucket_field, year=None):
+    """Returns a dataframe with first and last commit, organization and
+    project of each author (only for those whose last commit was made
+    within year, if provided), most recent first commit first.
+    """
     buckets_result = result['aggregations'][author_bucket_field]['buckets']
 
-    buckets = []
-    for bucket_author in buckets_result:
-        author = bucket_author['key']
-
-        first = bucket_author['first']['hits']['hits'][0]
-        first_commit = first['sort'][0]/1000
-        last_commit = bucket_author['last_commit']['value']/1000
-        org_name = first['_source']['author_org_name']
-        project = first['_source']['project']
-        #uuid = first['_source']['author_uuid']
-        buckets.append({
-                'first_commit': datetime.utcfromtimestamp(first_commit),
-                'last_commit': datetime.utcfromtimestamp(last_commit),
-                'author': author,
-                #'uuid': uuid,
-                'org': org_name,
-                'project': project
-        })
-    authors_df = pd.DataFrame.from_records(buckets)
+    firsts = [bucket_author['first']['hits']['hits'][0]
+              for bucket_author in buckets_result]
+    authors = np.array([bucket_author['key'] for bucket_author in buckets_result],
+                       dtype=object)
+    first_commits = np.array([first['sort'][0] for first in firsts],
+                             dtype='float64')
+    last_commits = np.array([bucket_author['last_commit']['value']
+                             for bucket_author in buckets_result],
+                            dtype='float64')
+    orgs = np.array([first['_source']['author_org_name'] for first in firsts],
+                    dtype=object)
+    projects = np.array([first['_source']['project'] for first in firsts],
+                        dtype=object)
+
+    # Epochs are in milliseconds
+    first_commits = pd.to_datetime(first_commits, unit='ms')
+    last_commits = pd.to_datetime(last_commits, unit='ms')
+
+    if year is not None:
+        mask = last_commits.year == year
+        first_commits = first_commits[mask]
+        last_commits = last_commits[mask]
+        authors = authors[mask]
+        orgs = orgs[mask]
+        projects = projects[mask]
+
+    authors_df = pd.DataFrame({
+        'first_commit': first_commits,
+        'last_commit': last_commits,
+        'author': authors,
+        'org': pd.Categorical(orgs),
+        'project': pd.Categorical(projects)
+    })
     authors_df.sort_values(by='first_commit', ascending=False,
                             inplace=True)
     return authors_df
 
+def get_authors_df(result, author_bucket_field):
+    """Returns a dataframe with first and last commit of each author"""
+
+    return _authors_df(result, author_bucket_field)
+
 def get_active_authors_df(result, author_bucket_field, year):
     """Returns a dataframe with first and last commit of those authors
     whose last commit was made within a given year"""
 
-    # Get a dataframe with each author and their first commit
-    buckets_result = result['aggregations'][author_bucket_field]['buckets']
-
-    buckets = []
-    for bucket_author in buckets_result:
-        author = bucket_author['key']
-
-        first = bucket_author['first']['hits']['hits'][0]
-        first_commit = first['sort'][0]/1000
-        last_commit = bucket_author['last_commit']['value']/1000
-        org_name = first['_source']['author_org_name']
-        project = first['_source']['project']
-        #uuid = first['_source']['author_uuid']
-        if datetime.utcfromtimestamp(last_commit).year == year:
-            buckets.append({
-                    'first_commit': datetime.utcfromtimestamp(first_commit),
-                    'last_commit': datetime.utcfromtimestamp(last_commit),
-                    'author': author,
-                    #'uuid': uuid,
-                    'org': org_name,
-                    'project': project
-            })
-    authors_df = pd.DataFrame.from_records(buckets)
-    authors_df.sort_values(by='first_commit', ascending=False,
-                            inplace=True)
-    return authors_df
+    return _authors_df(result, author_bucket_field, year=year)
 
 
 def to_df_by_time(result, group_column, time_column, value_column,subgroup_column,
 		 group_field, time_field, value_field, subgroup_field):
     """Creates a dataframe based on group and time values
     """
-    df = pd.DataFrame(columns=[group_column, time_column, value_column, subgroup_column])
-
-    for time in result.to_dict()['aggregations'][time_field]['buckets']:
-        for group in time[group_field]['buckets']:
-            for subgroup in group[subgroup_field]['buckets']:
-                df.loc[len(df)] = [group['key'], time['key_as_string'], subgroup[value_field]['value'], subgroup['key']]
+    df = buckets_to_df(result,
+                       columns=[time_column, group_column, subgroup_column, value_column],
+                       bucket_fields=[time_field, group_field, subgroup_field],
+                       value_field=value_field)
 
-    return df
+    return df[[group_column, time_column, value_column, subgroup_column]]
 
 def to_simple_df_by_time(result, group_column, time_column, value_column,
 		 group_field, time_field, value_field):
     """Creates a dataframe based on group and time values
     """
-    df = pd.DataFrame(columns=[group_column, time_column, value_column])
+    df = buckets_to_df(result,
+                       columns=[time_column, group_column, value_column],
+                       bucket_fields=[time_field, group_field],
+                       value_field=value_field)
 
-    for time in result.to_dict()['aggregations'][time_field]['buckets']:
-        for group in time[group_field]['buckets']:
-            df.loc[len(df)] = [group['key'], time['key_as_string'],
-                group[value_field]['value']]
-
-    return df
+    return df[[group_column, time_column, value_column]]
 
 
 ############################
@@ -22,9 +22,23 @@
 ##
 
 import argparse
+import bz2
+import collections
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+import datetime
+import fnmatch
+import gzip
+import itertools
 import json
 import logging
+import lzma
+import multiprocessing
+import os
 import pprint
+import queue
+import threading
+import time
+import urllib.parse
 import urllib3
 
 import elasticsearch
@@ -36,11 +50,52 @@ Example:
     elastic_cp --src http://elasctic.instance.xxx --src_index index \
         --dest dest_file.json
 
+If source and sink are in the same ElasticSearch instance, the reindex
+API is used, so that documents are copied within the instance.
+
+If the data sink ends with '/' (or is a directory), documents are written
+to several part files in it, with a manifest (mapping, documents and
+bytes per part). Such a directory can be used as data source, reading
+its parts in parallel.
+
+If the data sink ends with '.parquet', some fields of the documents are
+written to a columnar Parquet file (needs the pyarrow Python package).
+
 """
 
 # Disable warning about not verifying certificates
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Marks the end of the items read from a slice
+_END_OF_SLICE = object()
+
+# Openers for compressed files, by extension
+_COMPRESSED_OPENERS = {
+    '.gz': gzip.open,
+    '.xz': lzma.open,
+    '.bz2': bz2.open
+}
+
+# Buffer size for files, and items encoded / decoded per batch
+FILE_BUFFER = 16 * 1024 * 1024
+FILE_BATCH = 1000
+
+# Documents per search request, when reading with a search_after cursor
+SEARCH_AFTER_SIZE = 1000
+
+# Seconds between checks of the progress of a reindex task
+REINDEX_POLL = 10
+
+# Index settings while loading an index with --fast_load
+FAST_LOAD_SETTINGS = {
+    'refresh_interval': '-1',
+    'number_of_replicas': 0
+}
+
+# Timeout (secs) for requests restoring an index after --fast_load
+# (force merge may take long for large indexes)
+RESTORE_TIMEOUT = 3600
+
 def parse_args ():
 
     parser = argparse.ArgumentParser(description = description)
@@ -58,6 +113,46 @@ def parse_args ():
                         help = "Sink index (for ElasticSearch as data sink)")
     parser.add_argument("--match", type=str, nargs=2,
                         help = "Consider only documents with field value (only for ElasticSearch)")
+    parser.add_argument("--query", type=str,
+                        help = "Consider only documents matching query: JSON file, or inline JSON (only for ElasticSearch)")
+    parser.add_argument("--source_includes", type=str, nargs='+',
+                        help = "Fields of documents to read (only for ElasticSearch as data source)")
+    parser.add_argument("--source_excludes", type=str, nargs='+',
+                        help = "Fields of documents not to read (only for ElasticSearch as data source)")
+    parser.add_argument("--slices", type=int, default=1,
+                        help = "Number of sliced scrolls to read in parallel (only for ElasticSearch as data source)")
+    parser.add_argument("--bulk_workers", type=int, default=1,
+                        help = "Number of bulk requests in flight (only for ElasticSearch as data sink)")
+    parser.add_argument("--chunk_size", type=int, default=500,
+                        help = "Max number of documents per bulk request (default: 500)")
+    parser.add_argument("--max_chunk_bytes", type=int, default=104857600,
+                        help = "Max size of bulk requests (default: 100MB)")
+    parser.add_argument("--file_workers", type=int, default=1,
+                        help = "Number of processes encoding / decoding JSON (only for files)")
+    parser.add_argument("--parts", type=int, default=4,
+                        help = "Number of part files (and processes writing them) for directories as data sink (default: 4)")
+    parser.add_argument("--compression", type=str, choices=["gz", "xz", "bz2"],
+                        help = "Compression for part files, for directories as data sink")
+    parser.add_argument("--fields", type=str, nargs='+',
+                        help = "Fields to write, for Parquet files as data sink (default: all in mapping)")
+    parser.add_argument("--row_group_size", type=int, default=100000,
+                        help = "Documents per row group, for Parquet files as data sink (default: 100000)")
+    parser.add_argument("--since_field", type=str,
+                        help = "Field with the update date of documents, to copy only those updated since last run (needs --state, only for ElasticSearch as data source and sink)")
+    parser.add_argument("--state", type=str,
+                        help = "State file with the last value of --since_field copied")
+    parser.add_argument("--checkpoint", type=str,
+                        help = "Checkpoint file, to resume an interrupted copy (only for ElasticSearch as data source)")
+    parser.add_argument("--sort_field", type=str,
+                        help = "Unique field with doc values (eg, keyword) to sort documents by, for --checkpoint")
+    parser.add_argument("--no_reindex", dest="reindex", action="store_false",
+                        help = "Don't use the reindex API, even if source and sink are in the same ElasticSearch instance")
+    parser.add_argument("--remote_reindex", action="store_true",
+                        help = "Use the reindex API from a remote ElasticSearch instance (should be allowed in the sink instance)")
+    parser.add_argument("--fast_load", action="store_true",
+                        help = "Create index without refresh and replicas while loading, restoring them later (only for ElasticSearch as data sink, with mapping)")
+    parser.add_argument("--async_translog", action="store_true",
+                        help = "With --fast_load, use async translog while loading")
     parser.add_argument("--with_mapping", dest="with_mapping",
                         action="store_true",
                         help = "Get / set mapping (if available)")
@@ -75,6 +170,180 @@ def parse_args ():
     args = parser.parse_args()
     return args
 
+class Checkpoint():
+    """Class to persist the progress of a copy, to resume it if interrupted.
+
+    The checkpoint file stores (as JSON) the sort key of the last document
+    durably written to the sink, and maybe other data needed by the sink
+    to resume (eg, the size of the file written so far).
+
+    """
+
+    def __init__(self, path):
+        """Constructor for checkpoints, reading the checkpoint file if found.
+
+        :param path: checkpoint file path
+
+        """
+
+        self.path = path
+        try:
+            with open(self.path) as f:
+                self.state = json.load(f)
+            print("Resuming from checkpoint: {}".format(self.state['sort']))
+        except FileNotFoundError:
+            self.state = {}
+
+    @property
+    def sort(self):
+        """Sort key of the last document written (None if not resuming).
+
+        """
+
+        return self.state.get('sort')
+
+    def save(self, sort, **state):
+        """Save the checkpoint (atomically).
+
+        :param sort: sort key of the last document written
+        :param state: any other data to save
+
+        """
+
+        if sort is None:
+            return
+        self.state = dict(state, sort=sort)
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(self.state, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        logging.debug("Checkpoint saved: {}".format(self.state))
+
+    def remove(self):
+        """Remove the checkpoint file (copy completed).
+
+        """
+
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
+class Watermark():
+    """Class to keep the high-water mark of a field, for incremental copies.
+
+    The state file stores (as JSON) the field, and the highest value of it
+    among the documents copied so far. Values are compared as dates
+    (epoch millis), since they may be ISO 8601 strings with different
+    UTC offsets, or numbers (epoch millis).
+
+    """
+
+    def __init__(self, path, field):
+        """Constructor for watermarks, reading the state file if found.
+
+        :param  path: state file path
+        :param field: field with the update date of documents
+
+        """
+
+        self.path = path
+        self.field = field
+        self.value = None
+        try:
+            with open(self.path) as f:
+                state = json.load(f)
+            if state['field'] == self.field:
+                self.value = state['value']
+                print("Copying documents since: {}".format(self.value))
+            else:
+                print("Warning: state file for another field, copying all")
+        except FileNotFoundError:
+            pass
+        self.new_value = self.value
+        self.new_millis = self._millis(self.value)
+        self.tracked = 0
+        self.unparsed = 0
+
+    @staticmethod
+    def _millis(value):
+        """Epoch millis for a date value (None if it cannot be parsed).
+
+        Numbers (and strings of digits) are taken as epoch millis,
+        other strings are parsed as ISO 8601 dates (UTC if they have
+        no offset).
+
+        """
+
+        if isinstance(value, bool):
+            return None
+        if isinstance(value, (int, float)):
+            return value
+        if not isinstance(value, str):
+            return None
+        if value.isdigit():
+            return int(value)
+        try:
+            date = datetime.datetime.fromisoformat(value)
+        except ValueError:
+            return None
+        if date.tzinfo is None:
+            date = date.replace(tzinfo=datetime.timezone.utc)
+        return date.timestamp() * 1000
+
+    def query(self):
+        """Query for documents updated since the watermark (None if none).
+
+        Documents with the watermark value itself are included, since
+        some of them may have been updated after the last copy.
+
+        """
+
+        if self.value is None:
+            return None
+        return {'range': {self.field: {'gte': self.value}}}
+
+    def track(self, items):
+        """Generator passing items through, keeping the highest value
+        of the field (as found in documents, compared as epoch millis).
+
+        :param items: generator with items
+
+        """
+
+        for item in items:
+            if '_source' in item:
+                self.tracked += 1
+                value = item['_source'].get(self.field)
+                millis = self._millis(value)
+                if millis is None:
+                    if value is not None:
+                        self.unparsed += 1
+                elif self.new_millis is None or millis > self.new_millis:
+                    self.new_value = value
+                    self.new_millis = millis
+            yield item
+
+    def save(self):
+        """Save the new watermark (atomically).
+
+        """
+
+        if self.unparsed > 0:
+            print("Warning: {} values of {} not parsed as dates, ignored".format(
+                    self.unparsed, self.field))
+        if self.new_value is None:
+            if self.tracked > 0:
+                print("Warning: {} not found in documents copied, state not saved".format(self.field))
+            return
+        tmp_path = self.path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump({'field': self.field, 'value': self.new_value}, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.path)
+        print("Watermark saved: {}".format(self.new_value))
+
 class Store():
     """Class to interact with a data source or sink.
 
@@ -121,7 +390,11 @@ class Store():
             mapping = self._get_mapping()
             yield mapping
         else:
-            item = next(reader)
+            item = next(reader, None)
+            if item is None:
+                # Nothing to read
+                print("Items read: 0")
+                return
             if '_mapping' not in item:
                 # First element is not a mapping, yield
                 read = 1
@@ -151,7 +424,11 @@ class ESStore(Store):
 
     def __init__(self, instance, index, create=False,
                 with_mapping = False,
-                verify_certs=True, match=None):
+                verify_certs=True, match=None, slices=1,
+                bulk_workers=1, chunk_size=500, max_chunk_bytes=104857600,
+                checkpoint=None, sort_field=None,
+                query=None, source_includes=None, source_excludes=None,
+                keep_index=False, fast_load=False, async_translog=False):
         """Constructor for ElasticSearch stores.
 
         In case there is a dictionary for matching, it will be
@@ -160,11 +437,27 @@ class ESStore(Store):
                 field : value
                 }}
 
+        If there is also a query (any ElasticSearch query, such as
+        {"bool": {...}}), documents should match both.
+
         :param      str instance: url of the ElasticSearch instance
         :param         str index: index in ElasticSearch
         :param bool with_mapping: get / set mapping or not
         :param bool verify_certs: don't verify SSL certificate
         :param             match: dictionary for matching
+        :param        int slices: number of sliced scrolls to read in parallel
+        :param  int bulk_workers: number of bulk requests in flight
+        :param    int chunk_size: max number of documents per bulk request
+        :param int max_chunk_bytes: max size of bulk requests (bytes)
+        :param        checkpoint: Checkpoint to resume from / save (or None)
+        :param    str sort_field: unique field to sort by, for checkpoints
+        :param             query: dictionary with a query
+        :param   source_includes: list of fields to read (None for all)
+        :param   source_excludes: list of fields not to read
+        :param   bool keep_index: write to the index if it already exists,
+            instead of creating it (when writing mapping)
+        :param    bool fast_load: create index with settings for fast loading
+        :param bool async_translog: use async translog for fast loading
 
         """
 
@@ -172,8 +465,33 @@ class ESStore(Store):
         self.instance = instance
         self.index = index
         self.with_mapping = with_mapping
-        if match:
-            self.query = {'query': match}
+        self.slices = slices
+        self.bulk_workers = bulk_workers
+        self.chunk_size = chunk_size
+        self.max_chunk_bytes = max_chunk_bytes
+        self.checkpoint = checkpoint
+        self.sort_field = sort_field
+        self.keep_index = keep_index
+        self.fast_load = fast_load
+        self.async_translog = async_translog
+        # Settings to restore after fast loading (None if not fast loading)
+        self.restore_settings = None
+        # Body for searches, with query and _source filtering
+        body = {}
+        clauses = [clause for clause in (match, query) if clause]
+        if len(clauses) == 1:
+            body['query'] = clauses[0]
+        elif len(clauses) > 1:
+            body['query'] = {'bool': {'filter': clauses}}
+        source = {}
+        if source_includes:
+            source['includes'] = source_includes
+        if source_excludes:
+            source['excludes'] = source_excludes
+        if source:
+            body['_source'] = source
+        if body:
+            self.query = body
         else:
             self.query = None
         print("ElasticSearch: " + self.instance)
@@ -190,16 +508,98 @@ class ESStore(Store):
             else:
                 raise
 
+    def _scan(self, slice_id=None):
+        """Get a scan generator, for the whole index or for a slice.
+
+        :param slice_id: slice to scan (None for no slicing)
+
+        """
+
+        scan_args = {'client': self.es, 'index': self.index}
+        query = dict(self.query) if self.query else {}
+        if slice_id is not None:
+            query['slice'] = {'id': slice_id, 'max': self.slices}
+        if query:
+            scan_args['query'] = query
+        return elasticsearch.helpers.scan(**scan_args)
+
+    def _scan_slice(self, slice_id, items):
+        """Scan a slice, putting items read in a queue.
+
+        Errors are put in the queue too, and the end of the slice
+        is marked with _END_OF_SLICE.
+
+        :param slice_id: slice to scan
+        :param    items: queue for items read
+
+        """
+
+        try:
+            for item in self._scan(slice_id):
+                items.put(item)
+        except Exception as exception:
+            items.put(exception)
+        finally:
+            items.put(_END_OF_SLICE)
+
+    def _get_sliced_reader(self):
+        """Get a reader generator for several sliced scrolls in parallel.
+
+        Each slice is scanned in its own thread. Items are yielded
+        as they arrive (unordered), through a bounded queue.
+
+        """
+
+        items = queue.Queue(maxsize=1000 * self.slices)
+        for slice_id in range(self.slices):
+            thread = threading.Thread(target=self._scan_slice,
+                                    args=(slice_id, items), daemon=True)
+            thread.start()
+        running = self.slices
+        while running > 0:
+            item = items.get()
+            if item is _END_OF_SLICE:
+                running -= 1
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield item
+
+    def _search_after(self):
+        """Get a reader generator with a sorted search_after cursor.
+
+        Documents are read sorted by sort_field, starting after the
+        checkpoint (if any). Each of them includes its sort key.
+
+        """
+
+        body = dict(self.query) if self.query else {}
+        body['sort'] = [{self.sort_field: 'asc'}]
+        body['size'] = SEARCH_AFTER_SIZE
+        after = self.checkpoint.sort
+        while True:
+            if after is not None:
+                body['search_after'] = after
+            hits = self.es.search(index=self.index, body=body)['hits']['hits']
+            if not hits:
+                break
+            for hit in hits:
+                yield hit
+            after = hits[-1]['sort']
+
     def _get_reader(self):
         """Get a reader generator.
 
         """
 
-        scan_args = {'client': self.es, 'index': self.index}
-        if self.query:
-            scan_args['query'] = self.query
-        reader = elasticsearch.helpers.scan(**scan_args)
-        return reader
+        if self.checkpoint:
+            if self.slices > 1:
+                print("Warning: --slices ignored when using a checkpoint")
+            return self._search_after()
+        if self.slices > 1:
+            logging.info("Reading {} slices in parallel".format(self.slices))
+            return self._get_sliced_reader()
+        return self._scan()
 
     def _get_mapping(self):
         """Returns mapping for the index.
@@ -218,23 +618,275 @@ class ESStore(Store):
         logging.info(pprint.pformat(mapping))
         return mapping
 
-    def _to_actions(self, items):
-        """Generator which wraps items, preparing them as actions to be written.
+    def _to_lines(self, item):
+        """Prepare an item as an action to be written, in bulk format
+        (action and document, as JSON lines).
 
-        :param items: generator producing items to wrap
+        :param item: item to prepare
+        :return:     string with the lines
 
         """
 
-        for item in items:
-            to_write = {
-                '_op_type': 'index',
+        action = {'index': {
                 '_index': self.index,
                 '_type': item['_type'],
-                '_id': item['_id'],
-                '_source': item['_source']
-            }
-            logging.debug("Actions: {}".format(to_write))
-            yield to_write
+                '_id': item['_id']
+            }}
+        logging.debug("Action: {}".format(action))
+        return json.dumps(action) + '\n' + json.dumps(item['_source']) + '\n'
+
+    def _chunks(self, items):
+        """Generator grouping items in chunks for bulk requests.
+
+        Chunks have at most chunk_size items, and their bulk body
+        at most max_chunk_bytes (unless a single document is larger).
+        Items are serialized only once, here: the chunk includes
+        the lines to send.
+
+        :param items: generator producing items
+        :return:      (items, lines) tuples for each chunk
+
+        """
+
+        chunk = []
+        lines = []
+        chunk_bytes = 0
+        for item in items:
+            item_lines = self._to_lines(item)
+            if chunk and (len(chunk) >= self.chunk_size
+                    or chunk_bytes + len(item_lines) > self.max_chunk_bytes):
+                yield (chunk, lines)
+                chunk = []
+                lines = []
+                chunk_bytes = 0
+            chunk.append(item)
+            lines.append(item_lines)
+            chunk_bytes += len(item_lines)
+        if chunk:
+            yield (chunk, lines)
+
+    def _write_chunk(self, chunk, lines):
+        """Write a chunk of items in a single bulk request.
+
+        :param chunk: list of items
+        :param lines: list of items prepared for the bulk request
+        :return:      the chunk written
+
+        """
+
+        start = time.time()
+        response = self.es.bulk(body=''.join(lines))
+        if response.get('errors'):
+            errors = [result for result in response['items']
+                        if 'error' in list(result.values())[0]]
+            raise elasticsearch.helpers.BulkIndexError(
+                "{} document(s) failed to index.".format(len(errors)), errors)
+        logging.info("Bulk chunk written: {} items, {:.3f} secs".format(
+                        len(chunk), time.time() - start))
+        return chunk
+
+    def _bulk(self, items):
+        """Write items in chunks, with up to bulk_workers bulk requests
+        in flight.
+
+        Chunks are checked for completion in order, so that the checkpoint
+        (if any) is saved only when all previous chunks were written.
+
+        :param items: generator producing items
+
+        """
+
+        written = 0
+        start = time.time()
+        with ThreadPoolExecutor(max_workers=self.bulk_workers) as executor:
+            pending = collections.deque()
+            for (chunk, lines) in self._chunks(items):
+                pending.append(executor.submit(self._write_chunk,
+                                                chunk, lines))
+                # Bound the number of chunks waiting in memory
+                while len(pending) >= 2 * self.bulk_workers \
+                        or (pending and pending[0].done()):
+                    written += self._chunk_done(pending.popleft())
+            while pending:
+                written += self._chunk_done(pending.popleft())
+        print("Items written: {} ({:.1f} secs)".format(written,
+                                                    time.time() - start))
+
+    def _chunk_done(self, future):
+        """Wait for a chunk to be written, and save checkpoint.
+
+        :param future: future for the chunk being written
+        :return:       number of items written
+
+        """
+
+        chunk = future.result()
+        if self.checkpoint:
+            self.checkpoint.save(chunk[-1].get('sort'))
+        return len(chunk)
+
+    def _create_index(self, body):
+        """Create the index, with mapping (and maybe settings) in body.
+
+        If fast loading, the index is created with FAST_LOAD_SETTINGS,
+        remembering the settings to restore after loading (those in body,
+        or None to reset them to their defaults).
+
+        :param body: body for creating the index
+
+        """
+
+        if self.fast_load:
+            fast_settings = dict(FAST_LOAD_SETTINGS)
+            if self.async_translog:
+                fast_settings['translog.durability'] = 'async'
+            settings = dict(body.get('settings', {}))
+            index_settings = dict(settings.get('index', {}))
+            self.restore_settings = {}
+            for setting in fast_settings:
+                self.restore_settings[setting] = index_settings.get(setting,
+                                                settings.get(setting))
+                settings.pop(setting, None)
+            index_settings.update(fast_settings)
+            settings['index'] = index_settings
+            body = dict(body, settings=settings)
+            logging.info("Creating index for fast loading: {}".format(
+                            fast_settings))
+        self.es.indices.create(index=self.index, body=body)
+
+    def _restore_index(self, complete=True):
+        """Restore settings after fast loading, refresh and merge.
+
+        Called while finishing a copy (maybe because of an exception),
+        so errors are reported, but not raised.
+
+        :param complete: the copy completed (if not, the index is
+            not refreshed nor merged)
+
+        """
+
+        print("Restoring index settings: {}".format(self.restore_settings))
+        try:
+            self.es.indices.put_settings(index=self.index,
+                                    body={'index': self.restore_settings},
+                                    request_timeout=RESTORE_TIMEOUT)
+            if complete:
+                self.es.indices.refresh(index=self.index,
+                                    request_timeout=RESTORE_TIMEOUT)
+                self.es.indices.forcemerge(index=self.index,
+                                    request_timeout=RESTORE_TIMEOUT)
+        except elasticsearch.exceptions.ElasticsearchException as exception:
+            logging.error("Error restoring index {}: {}".format(self.index,
+                                                                exception))
+            print("Error restoring index, settings to restore: {}".format(
+                    self.restore_settings))
+        self.restore_settings = None
+
+    def same_instance(self, store):
+        """Check if another ElasticSearch store is in the same instance.
+
+        Credentials in urls are not considered.
+
+        :param store: ElasticSearch store
+        :return:      True if both stores are in the same instance
+
+        """
+
+        def location(instance):
+            url = urllib.parse.urlparse(instance)
+            port = url.port or (443 if url.scheme == 'https' else 80)
+            return (url.hostname, port, url.path.rstrip('/'))
+
+        return location(self.instance) == location(store.instance)
+
+    def _remote(self):
+        """Get the remote part of the source for reindexing from this store.
+
+        """
+
+        url = urllib.parse.urlparse(self.instance)
+        host = "{}://{}:{}{}".format(url.scheme, url.hostname,
+                        url.port or (443 if url.scheme == 'https' else 80),
+                        url.path.rstrip('/'))
+        remote = {'host': host}
+        if url.username:
+            remote['username'] = urllib.parse.unquote(url.username)
+            remote['password'] = urllib.parse.unquote(url.password or '')
+        return remote
+
+    def can_reindex(self, src):
+        """Check if the reindex API can be used to copy from src.
+
+        Not possible with checkpoints, or when excluding fields.
+
+        :param src: ElasticSearch store to copy from
+        :return:    True if reindexing is possible
+
+        """
+
+        if self.checkpoint or src.checkpoint:
+            return False
+        if src.query and '_source' in src.query \
+                and 'excludes' in src.query['_source']:
+            return False
+        return True
+
+    def reindex(self, src, slices=1, remote=False):
+        """Copy documents from src (in the same instance, or in a remote one)
+        using the reindex API, creating the index first if writing mapping.
+
+        Progress of the reindex task is polled every REINDEX_POLL seconds.
+
+        :param     src: ElasticSearch store to copy from
+        :param  slices: slices for the reindex task (1 for 'auto')
+        :param  remote: reindex from a remote instance
+
+        """
+
+        if self.with_mapping:
+            logging.info("Creating index with mapping")
+            self._create_index(src._get_mapping()['_mapping'])
+
+        source = {'index': src.index}
+        if src.query:
+            if 'query' in src.query:
+                source['query'] = src.query['query']
+            if '_source' in src.query:
+                source['_source'] = src.query['_source']['includes']
+        params = {'wait_for_completion': False}
+        if remote:
+            source['remote'] = src._remote()
+        else:
+            params['slices'] = slices if slices > 1 else 'auto'
+        body = {'source': source, 'dest': {'index': self.index}}
+        print("Reindexing from {} to {}".format(src.index, self.index))
+
+        try:
+            task_id = self.es.reindex(body=body, **params)['task']
+            while True:
+                task = self.es.tasks.get(task_id=task_id)
+                status = task['task']['status']
+                print("Items written: {} of {}".format(
+                        status['created'] + status['updated'], status['total']),
+                        end='\r')
+                if task.get('completed'):
+                    break
+                time.sleep(REINDEX_POLL)
+            print()
+            response = task.get('response', {})
+            if task.get('error') or response.get('failures'):
+                print("Error reindexing: {}".format(
+                        task.get('error') or response['failures']))
+                exit()
+            print("Items written: {} ({:.1f} secs)".format(
+                    response['created'] + response['updated'],
+                    response['took'] / 1000))
+        except BaseException:
+            if self.restore_settings is not None:
+                self._restore_index(complete=False)
+            raise
+        if self.restore_settings is not None:
+            self._restore_index()
 
     def write(self, items):
         """Write items to ElasticSearch instance and index.
@@ -243,13 +895,24 @@ class ESStore(Store):
 
         """
 
-        item = next(items)
+        item = next(items, None)
+        if item is None:
+            print("Items written: 0")
+            return
         if '_mapping' in item:
-            if self.with_mapping:
+            if self.checkpoint and self.checkpoint.sort is not None:
+                # Resuming, index already created
+                pass
+            elif self.with_mapping and self.keep_index \
+                    and self.es.indices.exists(index=self.index):
+                # Incremental copy, index already created
+                logging.info("Index already exists, not creating it")
+                if self.fast_load:
+                    print("Warning: index already exists, --fast_load not used")
+            elif self.with_mapping:
                 # Write mapping
                 logging.info("Creating index with mapping")
-                self.es.indices.create(index=self.index,
-                                        body=item['_mapping'])
+                self._create_index(item['_mapping'])
             else:
                 pass
         else:
@@ -257,36 +920,121 @@ class ESStore(Store):
                 print("Error: no mapping to write")
                 exit()
             else:
-                # Write normal item
-                actions = self._to_actions([item])
-                elasticsearch.helpers.bulk(self.es, actions)
-        actions = self._to_actions(items)
-        elasticsearch.helpers.bulk(self.es, actions)
+                # Write normal item, with the rest
+                items = itertools.chain([item], items)
+        try:
+            self._bulk(items)
+        except BaseException:
+            if self.restore_settings is not None:
+                self._restore_index(complete=False)
+            raise
+        if self.restore_settings is not None:
+            self._restore_index()
+
+def open_file(path, mode):
+    """Open a file in text mode, compressed according to its extension
+    (.gz, .xz, .bz2), or plain (buffered) for any other extension.
+
+    :param path: file path
+    :param mode: 'r' for reading, 'w' for writing
+
+    """
+
+    for extension, opener in _COMPRESSED_OPENERS.items():
+        if path.endswith(extension):
+            return opener(path, mode + 't')
+    return open(path, mode, buffering=FILE_BUFFER)
+
+def _batches(items, size):
+    """Generator grouping items in lists of (at most) size items.
+
+    """
+
+    batch = []
+    for item in items:
+        batch.append(item)
+        if len(batch) >= size:
+            yield batch
+            batch = []
+    if batch:
+        yield batch
+
+def _encode_batch(items):
+    """Encode a batch of items as JSON lines, in a single string.
+
+    """
+
+    return ''.join([json.dumps(item) + '\n' for item in items])
+
+def _decode_batch(lines):
+    """Decode a batch of JSON lines.
+
+    """
+
+    return [json.loads(line) for line in lines]
+
+def _map_batches(func, batches, workers):
+    """Generator applying func to batches, in order, with a pool of workers
+    processes (or in this process, if workers is 1).
+
+    """
+
+    if workers <= 1:
+        for batch in batches:
+            yield func(batch)
+        return
+    with ProcessPoolExecutor(max_workers=workers) as executor:
+        pending = collections.deque()
+        for batch in batches:
+            pending.append(executor.submit(func, batch))
+            # Bound the number of batches waiting in memory
+            if len(pending) >= 2 * workers:
+                yield pending.popleft().result()
+        while pending:
+            yield pending.popleft().result()
 
 class FileStore(Store):
     """Class to interact with a file.
 
+    Files are compressed if their name ends in .gz, .xz or .bz2.
+
     """
 
-    def __init__(self, path, with_mapping = False):
+    def __init__(self, path, with_mapping = False, workers=1,
+                checkpoint=None):
         """Constructor for file stores.
 
         :param      path: file path
         :param bool with_mapping: get / set mapping or not
+        :param   int workers: number of processes encoding / decoding JSON
+        :param    checkpoint: Checkpoint to resume from / save (or None)
 
         """
 
         super().__init__()
         self.path = path
         self.with_mapping = with_mapping
+        self.workers = workers
+        self.checkpoint = checkpoint
         print("File: " + self.path)
 
+    def _decode(self, lines):
+        """Generator decoding JSON lines, in batches.
+
+        """
+
+        batches = _batches(lines, FILE_BATCH)
+        for items in _map_batches(_decode_batch, batches, self.workers):
+            for item in items:
+                yield item
+
     def _get_reader(self):
-        """Get a reader generator.
+        """Get a reader generator, producing decoded items.
 
         """
 
-        self.reader = open(self.path)
+        self.file = open_file(self.path, 'r')
+        self.reader = self._decode(self.file)
         return self.reader
 
     def _get_mapping(self):
@@ -294,7 +1042,7 @@ class FileStore(Store):
 
         """
 
-        mapping = json.loads(next(self.reader))
+        mapping = next(self.reader)
         if '_mapping' not in mapping:
             print("Error: no mapping to read")
             exit()
@@ -302,29 +1050,64 @@ class FileStore(Store):
         logging.info(pprint.pformat(mapping))
         return mapping
 
-    def _produce_item(self, item):
-        """Produce an item, based on the item read.
+    def _open_for_write(self):
+        """Open the file for writing.
 
-        The returned object should be a dictionary, ready for
-        consumption.
-        Default: just return item.
+        When resuming from a checkpoint, anything written after it is
+        truncated, and the file is opened for appending.
+
+        :return: tuple (file, resuming or not)
 
         """
 
-        return json.loads(item)
+        if self.checkpoint and self.checkpoint.sort is not None:
+            with open(self.path, 'r+b') as f:
+                f.truncate(self.checkpoint.state['size'])
+            return (open_file(self.path, 'a'), True)
+        return (open_file(self.path, 'w'), False)
+
+    def _sync(self, f):
+        """Ensure everything written to the file is on disk.
+
+        Compressed files are closed (so that they are readable up to
+        this point) and opened again for appending.
+
+        :param f: file being written
+        :return:  tuple (file to continue writing, size of the file)
 
+        """
+
+        if self.path.endswith(tuple(_COMPRESSED_OPENERS.keys())):
+            f.close()
+            fd = os.open(self.path, os.O_RDONLY)
+            os.fsync(fd)
+            os.close(fd)
+            size = os.path.getsize(self.path)
+            f = open_file(self.path, 'a')
+        else:
+            f.flush()
+            os.fsync(f.fileno())
+            size = os.path.getsize(self.path)
+        return (f, size)
 
     def write(self, items, mapping=None):
         """Write items to file.
 
+        If there is a checkpoint, it is saved after each batch of items
+        is on disk.
+
         :param items: generator with items to write
 
         """
 
-        with open(self.path, 'w') as f:
-            item = next(items)
+        (f, resuming) = self._open_for_write()
+        try:
+            item = next(items, None)
+            if item is None:
+                # Nothing to write, the file is left empty
+                return
             if '_mapping' in item:
-                if self.with_mapping:
+                if self.with_mapping and not resuming:
                     # Write mapping
                     f.write(json.dumps(item) + '\n')
                 else:
@@ -336,9 +1119,538 @@ class FileStore(Store):
                 else:
                     # Write normal item
                     f.write(json.dumps(item) + '\n')
-            # Write the rest of items
-            for item in items:
-                f.write(json.dumps(item) + '\n')
+            # Sort key of the last item of each batch, for checkpoints
+            last_sorts = collections.deque()
+            def batches():
+                for batch in _batches(items, FILE_BATCH):
+                    last_sorts.append(batch[-1].get('sort'))
+                    yield batch
+            # Write the rest of items, a batch at a time
+            for lines in _map_batches(_encode_batch, batches(), self.workers):
+                f.write(lines)
+                last_sort = last_sorts.popleft()
+                if self.checkpoint:
+                    (f, size) = self._sync(f)
+                    self.checkpoint.save(last_sort, size=size)
+        finally:
+            f.close()
+
+def _write_part(path, batches, results):
+    """Write batches of items from a queue to a part file (in its own process).
+
+    When a batch is None, the part is done. Then, (path, number of items)
+    is put in the results queue. In case of error, the exception is put
+    instead, and batches are still consumed (so that the writer doesn't
+    block).
+
+    :param    path: part file path
+    :param batches: queue with batches of items
+    :param results: queue for the result
+
+    """
+
+    docs = 0
+    try:
+        with open_file(path, 'w') as f:
+            for batch in iter(batches.get, None):
+                f.write(_encode_batch(batch))
+                docs += len(batch)
+        results.put((path, docs))
+    except Exception as exception:
+        results.put(exception)
+        for batch in iter(batches.get, None):
+            pass
+
+def _check_alive(processes):
+    """Raise an exception if any of processes died with an error.
+
+    """
+
+    for process in processes:
+        if process.exitcode not in (None, 0):
+            raise RuntimeError("Process {} died (exit code {})".format(
+                                process.name, process.exitcode))
+
+def _put_checked(batches, batch, process):
+    """Put a batch in a queue consumed by process, failing if the process
+    dies (instead of blocking forever).
+
+    :param batches: queue
+    :param   batch: batch to put in the queue
+    :param process: process consuming the queue
+
+    """
+
+    while True:
+        try:
+            batches.put(batch, timeout=1)
+            return
+        except queue.Full:
+            _check_alive([process])
+
+def _read_part(path, batches):
+    """Read a part file, putting batches of items in a queue (in its
+    own process).
+
+    Errors are put in the queue too, and the end of the part is marked
+    with None.
+
+    :param    path: part file path
+    :param batches: queue for batches of items
+
+    """
+
+    try:
+        with open_file(path, 'r') as f:
+            for lines in _batches(f, FILE_BATCH):
+                batches.put(_decode_batch(lines))
+    except Exception as exception:
+        batches.put(exception)
+    finally:
+        batches.put(None)
+
+class DirStore(Store):
+    """Class to interact with a directory with part files.
+
+    Documents are split in several part files (part-00000.jsonl, ...),
+    written and read in parallel, one process per part. A manifest
+    (manifest.json) includes the mapping (if any), and the number of
+    documents and bytes of each part.
+
+    """
+
+    def __init__(self, path, with_mapping = False, parts=4,
+                compression=None):
+        """Constructor for directory stores.
+
+        :param      path: directory path
+        :param bool with_mapping: get / set mapping or not
+        :param   int parts: number of part files to write
+        :param compression: compression for part files to write (gz, xz, bz2)
+
+        """
+
+        super().__init__()
+        self.path = path
+        self.with_mapping = with_mapping
+        self.parts = parts
+        self.compression = compression
+        self.manifest_path = os.path.join(self.path, 'manifest.json')
+        print("Directory: " + self.path)
+
+    def _part_path(self, part):
+        """Path for a part file.
+
+        """
+
+        name = 'part-{:05d}.jsonl'.format(part)
+        if self.compression:
+            name += '.' + self.compression
+        return os.path.join(self.path, name)
+
+    def _read_manifest(self):
+        """Read the manifest, if not read yet.
+
+        """
+
+        if not hasattr(self, 'manifest'):
+            with open(self.manifest_path) as f:
+                self.manifest = json.load(f)
+        return self.manifest
+
+    def _get_reader(self):
+        """Get a reader generator, reading all parts in parallel.
+
+        """
+
+        manifest = self._read_manifest()
+        parts = [os.path.join(self.path, part['file'])
+                for part in manifest['parts']]
+        batches = multiprocessing.Queue(maxsize=2 * len(parts))
+        readers = [multiprocessing.Process(target=_read_part,
+                                            args=(part, batches), daemon=True)
+                    for part in parts]
+        for reader in readers:
+            reader.start()
+        return self._merge(batches, readers)
+
+    def _merge(self, batches, readers):
+        """Generator yielding items in batches from the reader processes.
+
+        """
+
+        running = len(readers)
+        while running > 0:
+            batch = batches.get()
+            if batch is None:
+                running -= 1
+            elif isinstance(batch, Exception):
+                raise batch
+            else:
+                for item in batch:
+                    yield item
+        for reader in readers:
+            reader.join()
+
+    def _get_mapping(self):
+        """Returns mapping from the manifest.
+
+        """
+
+        mapping = self._read_manifest().get('mapping')
+        if mapping is None:
+            print("Error: no mapping to read")
+            exit()
+        mapping = {'_mapping': mapping}
+        logging.info("Mapping retrieved:")
+        logging.info(pprint.pformat(mapping))
+        return mapping
+
+    def _write_manifest(self, manifest):
+        """Write the manifest (atomically).
+
+        """
+
+        with open(self.manifest_path + '.tmp', 'w') as f:
+            json.dump(manifest, f, indent=2)
+        os.replace(self.manifest_path + '.tmp', self.manifest_path)
+
+    def write(self, items):
+        """Write items to part files, and the manifest.
+
+        Batches of items are sent to part writers round robin.
+
+        :param items: generator with items to write
+
+        """
+
+        os.makedirs(self.path, exist_ok=True)
+        item = next(items, None)
+        if item is None:
+            # Manifest with no parts, so that the directory can be a source
+            self._write_manifest({'mapping': None, 'parts': []})
+            print("Items written: 0")
+            return
+        mapping = None
+        if '_mapping' in item:
+            if self.with_mapping:
+                mapping = item['_mapping']
+        else:
+            if self.with_mapping:
+                print("Error: no mapping to write")
+                exit()
+            else:
+                items = itertools.chain([item], items)
+
+        results = multiprocessing.Queue()
+        queues = []
+        writers = []
+        for part in range(self.parts):
+            batches = multiprocessing.Queue(maxsize=2)
+            writer = multiprocessing.Process(target=_write_part,
+                                args=(self._part_path(part), batches, results),
+                                daemon=True)
+            writer.start()
+            queues.append(batches)
+            writers.append(writer)
+        try:
+            for count, batch in enumerate(_batches(items, FILE_BATCH)):
+                part = count % self.parts
+                _put_checked(queues[part], batch, writers[part])
+            for part in range(self.parts):
+                _put_checked(queues[part], None, writers[part])
+            written = []
+            while len(written) < len(writers):
+                try:
+                    written.append(results.get(timeout=1))
+                except queue.Empty:
+                    _check_alive(writers)
+        except BaseException:
+            # Error reading items, or in a writer: don't wait for them
+            for writer in writers:
+                writer.terminate()
+            raise
+        for writer in writers:
+            writer.join()
+        for result in written:
+            if isinstance(result, Exception):
+                raise result
+
+        manifest = {'mapping': mapping, 'parts': []}
+        for (path, docs) in sorted(written):
+            manifest['parts'].append({'file': os.path.basename(path),
+                                    'docs': docs,
+                                    'bytes': os.path.getsize(path)})
+        self._write_manifest(manifest)
+        print("Items written: {} (in {} parts)".format(
+            sum(part['docs'] for part in manifest['parts']), self.parts))
+
+def _mapping_types(mapping):
+    """Get the ElasticSearch type of each field in a mapping.
+
+    :param mapping: mapping, as produced by ESStore (without '_mapping')
+    :return:        dictionary with the type of each (top level) field
+
+    """
+
+    mappings = mapping.get('mappings', {})
+    if 'properties' in mappings:
+        properties = mappings['properties']
+    else:
+        # Mappings by document type
+        properties = {}
+        for doc_type in mappings.values():
+            properties.update(doc_type.get('properties', {}))
+    return {field: properties[field].get('type', 'object')
+            for field in properties}
+
+class ParquetStore(Store):
+    """Class to write some fields of documents to a Parquet file.
+
+    Documents are written in row groups, so that only one of them is
+    in memory at a time. Columns get their type from the mapping, if
+    available, or from the first row group if not.
+
+    """
+
+    # Arrow types for ElasticSearch types (string for any other)
+    ARROW_TYPES = {
+        'long': 'int64',
+        'integer': 'int64',
+        'short': 'int64',
+        'byte': 'int64',
+        'double': 'float64',
+        'float': 'float64',
+        'half_float': 'float64',
+        'scaled_float': 'float64',
+        'boolean': 'bool_'
+    }
+
+    def __init__(self, path, fields=None, row_group_size=100000):
+        """Constructor for Parquet stores.
+
+        :param      path: file path
+        :param    fields: fields to write ('_id' for the document id),
+            all in the mapping if None
+        :param int row_group_size: documents per row group
+
+        """
+
+        super().__init__()
+        try:
+            import pyarrow
+            import pyarrow.parquet
+        except ImportError:
+            print("Error: pyarrow is needed for writing Parquet files.")
+            exit()
+        self.pa = pyarrow
+        self.pq = pyarrow.parquet
+        self.path = path
+        self.fields = fields
+        self.row_group_size = row_group_size
+        print("Parquet file: " + self.path)
+
+    def _values(self, batch, field):
+        """Get values of a field from a batch of items.
+
+        """
+
+        if field == '_id':
+            return [item['_id'] for item in batch]
+        return [item['_source'].get(field) for item in batch]
+
+    def _coerce(self, value, arrow_type):
+        """Coerce a value to an Arrow type.
+
+        ElasticSearch accepts, for example, "2" or [2] for a long field.
+        Values which are not strings are encoded as JSON for string types.
+        Raises TypeError, ValueError or OverflowError if not possible.
+
+        """
+
+        if value is None:
+            return None
+        if self.pa.types.is_string(arrow_type):
+            return value if isinstance(value, str) else json.dumps(value)
+        if isinstance(value, list) and len(value) == 1:
+            value = value[0]
+        if isinstance(value, (list, dict)):
+            raise TypeError("not a single value")
+        if self.pa.types.is_integer(arrow_type):
+            if isinstance(value, float) and not value.is_integer():
+                raise ValueError("not an integer")
+            value = int(value)
+            if not -2**63 <= value < 2**63:
+                raise OverflowError("out of range")
+            return value
+        if self.pa.types.is_floating(arrow_type):
+            return float(value)
+        if self.pa.types.is_boolean(arrow_type):
+            if isinstance(value, bool):
+                return value
+            if value in ('true', 'false'):
+                return value == 'true'
+            raise ValueError("not a boolean")
+        return value
+
+    def _array(self, values, arrow_type):
+        """Arrow array of a type, coercing values if needed.
+
+        :return: (array, number of values which couldn't be coerced,
+            and were set to null) tuple
+
+        """
+
+        try:
+            return (self.pa.array(values, type=arrow_type), 0)
+        except (self.pa.ArrowInvalid, self.pa.ArrowTypeError,
+                TypeError, ValueError, OverflowError):
+            pass
+        coerced = []
+        failed = 0
+        for value in values:
+            try:
+                coerced.append(self._coerce(value, arrow_type))
+            except (TypeError, ValueError, OverflowError):
+                coerced.append(None)
+                failed += 1
+        return (self.pa.array(coerced, type=arrow_type), failed)
+
+    def _infer_type(self, values):
+        """Infer the Arrow type for a column (with no mapping).
+
+        Numbers and booleans keep their type, anything else
+        (including columns mixing types) is a string.
+
+        """
+
+        try:
+            arrow_type = self.pa.array(values).type
+        except (self.pa.ArrowInvalid, self.pa.ArrowTypeError,
+                TypeError, ValueError, OverflowError):
+            return self.pa.string()
+        if self.pa.types.is_integer(arrow_type) \
+                or self.pa.types.is_floating(arrow_type) \
+                or self.pa.types.is_boolean(arrow_type):
+            return arrow_type
+        return self.pa.string()
+
+    def _schema(self, types, batch):
+        """Schema for the Parquet file.
+
+        Fields with values in the first row group which can't be
+        coerced to the type in the mapping are written as strings.
+
+        :param types: ElasticSearch type of each field (from mapping)
+        :param batch: items for the first row group
+
+        """
+
+        schema = []
+        for field in self.fields:
+            values = self._values(batch, field)
+            if field == '_id':
+                arrow_type = self.pa.string()
+            elif field in types:
+                arrow_type = getattr(self.pa, self.ARROW_TYPES.get(types[field],
+                                                                'string'))()
+                (array, failed) = self._array(values, arrow_type)
+                if failed > 0:
+                    logging.warning("Field {} written as string: values "
+                                    "not of type {}".format(field, types[field]))
+                    arrow_type = self.pa.string()
+            else:
+                arrow_type = self._infer_type(values)
+            schema.append((field, arrow_type))
+        return self.pa.schema(schema)
+
+    def _table(self, batch, schema):
+        """Get table with the fields to write from a batch of items.
+
+        :return: (table, number of values set to null) tuple
+
+        """
+
+        arrays = []
+        failed = 0
+        for field in schema:
+            (array, field_failed) = self._array(
+                                self._values(batch, field.name), field.type)
+            arrays.append(array)
+            failed += field_failed
+        return (self.pa.Table.from_arrays(arrays, schema=schema), failed)
+
+    def write(self, items):
+        """Write items to the Parquet file.
+
+        The file is written with a temporary name, and renamed
+        only when complete.
+
+        :param items: generator with items to write
+
+        """
+
+        types = {}
+        item = next(items, None)
+        if item is None:
+            print("Items written: 0")
+            return
+        if '_mapping' in item:
+            types = _mapping_types(item['_mapping'])
+        else:
+            items = itertools.chain([item], items)
+        if self.fields is None:
+            if not types:
+                print("Error: --fields needed when there is no mapping")
+                exit()
+            self.fields = sorted(types.keys())
+
+        tmp_path = self.path + '.tmp'
+        writer = None
+        written = 0
+        failed = 0
+        try:
+            for batch in _batches(items, self.row_group_size):
+                if writer is None:
+                    schema = self._schema(types, batch)
+                    writer = self.pq.ParquetWriter(tmp_path, schema)
+                (table, batch_failed) = self._table(batch, schema)
+                writer.write_table(table)
+                written += len(batch)
+                failed += batch_failed
+            if writer is not None:
+                writer.close()
+                writer = None
+                os.replace(tmp_path, self.path)
+        finally:
+            if writer is not None:
+                writer.close()
+            if os.path.exists(tmp_path):
+                os.remove(tmp_path)
+        if failed > 0:
+            print("Warning: {} values not of the type of their field, "
+                "written as null".format(failed))
+        print("Items written: {}".format(written))
+
+def load_query(query):
+    """Load a query from a JSON file, or from inline JSON.
+
+    The query may be a query clause (eg, {"bool": {...}}), or
+    a search body with it in its "query" field.
+
+    :param query: JSON file path, or JSON string
+    :return:      dictionary with the query clause
+
+    """
+
+    if os.path.isfile(query):
+        with open(query) as f:
+            query = json.load(f)
+    else:
+        query = json.loads(query)
+    if 'query' in query:
+        query = query['query']
+    return query
 
 def main():
     args = parse_args()
@@ -354,6 +1666,38 @@ def main():
         else:
             logging.basicConfig(format=log_format, level=level)
 
+    if args.fast_load and not args.with_mapping:
+        # Without mapping, the index is not created (with fast settings)
+        print("Error: --fast_load needs --with_mapping")
+        exit()
+
+    if args.checkpoint:
+        if not args.sort_field:
+            # Sorting by _id would need fielddata for it (costly, or
+            # not allowed in recent versions of ElasticSearch)
+            print("Error: --checkpoint needs --sort_field")
+            exit()
+        checkpoint = Checkpoint(args.checkpoint)
+        if args.fast_load and checkpoint.sort is not None:
+            # Resuming, index already created (and not created again)
+            print("Warning: resuming from checkpoint, --fast_load not used")
+    else:
+        checkpoint = None
+
+    if args.since_field or args.state:
+        if not (args.since_field and args.state):
+            print("Error: --since_field and --state should be used together")
+            exit()
+        if not (args.dest.startswith('http://') or
+                args.dest.startswith('https://')):
+            # Files, directories and Parquet files are rewritten,
+            # so only the last increment would be kept
+            print("Error: --state needs ElasticSearch as data sink")
+            exit()
+        watermark = Watermark(args.state, args.since_field)
+    else:
+        watermark = None
+
     if args.src.startswith('http://') or args.src.startswith('https://'):
         if args.match:
             match = {"match" : {
@@ -363,23 +1707,96 @@ def main():
                                                 args.match[1]))
         else:
             match = None
+        if args.query:
+            query = load_query(args.query)
+            print("Filtering for query: {}".format(json.dumps(query)))
+        else:
+            query = None
+        if watermark and watermark.query():
+            if query:
+                query = {'bool': {'filter': [query, watermark.query()]}}
+            else:
+                query = watermark.query()
+        if watermark and args.source_excludes and \
+                any(fnmatch.fnmatch(watermark.field, pattern)
+                    for pattern in args.source_excludes):
+            print("Error: --since_field can't be in --source_excludes")
+            exit()
+        source_includes = args.source_includes
+        if not source_includes and args.dest.endswith('.parquet') \
+                and args.fields:
+            # Read only the fields to write
+            source_includes = [field for field in args.fields
+                                if field != '_id'] or None
+        if watermark and source_includes \
+                and watermark.field not in source_includes:
+            source_includes = source_includes + [watermark.field]
         src = ESStore(instance=args.src, index=args.src_index,
                         with_mapping = args.with_mapping,
                         verify_certs=args.verify_certs,
-                        match = match)
+                        match = match, slices = args.slices,
+                        checkpoint = checkpoint,
+                        sort_field = args.sort_field,
+                        query = query,
+                        source_includes = source_includes,
+                        source_excludes = args.source_excludes)
+    elif checkpoint or watermark:
+        print("Error: --checkpoint and --state need ElasticSearch as data source")
+        exit()
+    elif os.path.isdir(args.src):
+        src = DirStore(path=args.src,
+                        with_mapping = args.with_mapping)
     else:
         src = FileStore(path=args.src,
-                        with_mapping = args.with_mapping)
+                        with_mapping = args.with_mapping,
+                        workers = args.file_workers)
     if args.dest.startswith('http://') or \
             args.dest.startswith('https://'):
         dest = ESStore(instance=args.dest, index=args.dest_index,
                         with_mapping = args.with_mapping,
-                        verify_certs=args.verify_certs)
+                        verify_certs=args.verify_certs,
+                        bulk_workers = args.bulk_workers,
+                        chunk_size = args.chunk_size,
+                        max_chunk_bytes = args.max_chunk_bytes,
+                        checkpoint = checkpoint,
+                        keep_index = watermark is not None,
+                        fast_load = args.fast_load,
+                        async_translog = args.async_translog)
+    elif args.dest.endswith('.parquet'):
+        if checkpoint:
+            print("Error: --checkpoint is not available for Parquet files")
+            exit()
+        dest = ParquetStore(path=args.dest,
+                        fields = args.fields,
+                        row_group_size = args.row_group_size)
+    elif args.dest.endswith('/') or os.path.isdir(args.dest):
+        if checkpoint:
+            print("Error: --checkpoint is not available for directories")
+            exit()
+        dest = DirStore(path=args.dest,
+                        with_mapping = args.with_mapping,
+                        parts = args.parts,
+                        compression = args.compression)
     else:
         dest = FileStore(path=args.dest,
-                        with_mapping = args.with_mapping)
-
-    dest.write(src.read())
+                        with_mapping = args.with_mapping,
+                        workers = args.file_workers,
+                        checkpoint = checkpoint)
+
+    if args.reindex and not watermark \
+            and isinstance(src, ESStore) and isinstance(dest, ESStore) \
+            and dest.can_reindex(src) \
+            and (args.remote_reindex or dest.same_instance(src)):
+        dest.reindex(src, slices=args.slices, remote=args.remote_reindex)
+    elif watermark:
+        dest.write(watermark.track(src.read()))
+        # Only when everything was written
+        watermark.save()
+    else:
+        dest.write(src.read())
+    if checkpoint:
+        # Copy completed, nothing to resume
+        checkpoint.remove()
 
 if __name__ == "__main__":
     main()
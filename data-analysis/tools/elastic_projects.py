@@ -22,9 +22,13 @@
 ##
 
 import argparse
+from concurrent.futures import ThreadPoolExecutor
+import hashlib
 import json
 import logging
+import os
 from pprint import pprint
+import time
 import urllib3
 
 import elasticsearch
@@ -44,6 +48,13 @@ Example:
 # Disable warning about not verifying certificates
 urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
 
+# Max number of repos per query (terms, or should clauses)
+MAX_TERMS = 1000
+# Buckets per page, for composite aggregations
+COMPOSITE_SIZE = 1000
+# Seconds between checks of the progress of a task
+TASK_POLL = 10
+
 def parse_args ():
 
     parser = argparse.ArgumentParser(description = description)
@@ -65,9 +76,21 @@ def parse_args ():
                         help = "Discourse posts index to update")
     parser.add_argument("--projects", type=str,
                         help = "Excel file with projects data")
+    parser.add_argument("--compiled", type=str,
+                        help = "Compiled projects file (JSON), used instead of the spreadsheet if it was compiled from it (created otherwise)")
     parser.add_argument("--show_projects",
                         action="store_true",
                         help = "Show found projects")
+    parser.add_argument("--update_by_query",
+                        action="store_true",
+                        help = "Update in ElasticSearch with update_by_query, without retrieving documents")
+    parser.add_argument("--dry_run",
+                        action="store_true",
+                        help = "Show changes to do (per project), and repos not found in spreadsheet, but don't update")
+    parser.add_argument("--slices", type=int,
+                        help = "Slices for update_by_query (default: auto)")
+    parser.add_argument("--workers", type=int, default=5,
+                        help = "Max number of indexes to annotate concurrently (default: 5)")
     parser.add_argument("--verify_certs", dest="verify_certs",
                         action="store_true",
                         help = "Verify ssl certificates")
@@ -91,7 +114,8 @@ class Index():
     """
 
     def __init__(self, instance, index,
-                scroll_period, max_chunk, verify_certs=True):
+                scroll_period, max_chunk, verify_certs=True,
+                progress_lines=False):
         """Constructor for ElasticSearch indexes.
 
         change_ops is a dictionary which encodes the change operation
@@ -99,12 +123,15 @@ class Index():
           - index: the index name
           - to_check: the fields to check in the index
           - to_change: the fields to change in the index
+          - sheet: the sheet in the spreadsheet with the projects
 
         :param      str instance: url of the ElasticSearch instance
         :param         str index: index in ElasticSearch
         :param scroll_period:     period for scroll object (eg: u'5m')
         :param max_chunk:         max chunk size for bulk upload (bytes)
         :param bool verify_certs: don't verify SSL certificate
+        :param progress_lines:    show progress in separate lines
+            (for indexes annotated concurrently)
 
         """
 
@@ -117,6 +144,10 @@ class Index():
         self.to_get = self.to_check + self.to_change
         self.scroll_period = scroll_period
         self.max_chunk = max_chunk
+        if progress_lines:
+            (self.progress_every, self.progress_end) = (100000, '\n')
+        else:
+            (self.progress_every, self.progress_end) = (1000, '\r')
         logging.debug("ElasticSearch instance: " + self.instance)
         try:
             self.es = elasticsearch.Elasticsearch([self.instance],
@@ -128,23 +159,76 @@ class Index():
                 exit()
             else:
                 raise
+        self.reader = self._scan()
+
+    def _scan(self, query=None):
+        """Scan the index (generator).
+
+        :param query: query for documents to scan (None for all)
+
+        """
+
+        kwargs = {}
+        if query is not None:
+            kwargs['query'] = {'query': query}
         # _source parameter to get only the fields we need
-        self.reader = elasticsearch.helpers.scan(client=self.es,
+        return elasticsearch.helpers.scan(client=self.es,
                                 index=self.index,
                                 scroll=self.scroll_period,
                                 request_timeout=30,
-                                _source=self.to_check+self.to_change)
-
+                                _source=self.to_check+self.to_change,
+                                **kwargs)
 
-    def read(self):
+    def read(self, projects=None):
         """Read from the index, maybe using a buffer (generator).
 
+        If projects is specified, only documents with a project different
+        from the one in projects are read.
+
+        :param projects: dictionary with the project for each repo
         :return: Python genrator returning items read from the data store.
 
         """
 
-        for item in self.reader:
-            yield item
+        if projects is None:
+            for item in self.reader:
+                yield item
+        else:
+            for query in self._wrong_queries(projects):
+                for item in self._scan(query):
+                    yield item
+
+    def _wrong_queries(self, projects):
+        """Queries for documents in the wrong project.
+
+        Repos with documents in the wrong project are found with an
+        aggregation (see _changes). The resulting clauses are packed
+        in queries with at most MAX_TERMS repos each.
+
+        :param projects: dictionary with the project for each repo
+        :return: list of queries
+
+        """
+
+        (repos_projects, counts, unmapped) = self._changes(projects)
+        clauses = [self._wrong_project(self._missing_query(), 'Not tracked')]
+        sizes = [1]
+        for project in sorted(repos_projects.keys()):
+            for chunk in _chunks(repos_projects[project], MAX_TERMS):
+                clauses.append(self._wrong_project(self._repos_query(chunk),
+                                                    project))
+                sizes.append(len(chunk))
+        queries = []
+        (current, size) = ([], 0)
+        for (clause, clause_size) in zip(clauses, sizes):
+            if current and (size + clause_size > MAX_TERMS):
+                queries.append(current)
+                (current, size) = ([], 0)
+            current.append(clause)
+            size += clause_size
+        queries.append(current)
+        return [{'bool': {'should': query, 'minimum_should_match': 1}}
+                for query in queries]
 
     def _normalize_values(self, values):
         """Normalize values obtained from the database, if needed.
@@ -157,13 +241,16 @@ class Index():
         """Get the relevant fields from an item in the index.
 
         :param item: item in the index
-        :return:     list with relevant fields
+        :return:     list with relevant fields (repo is None if missing)
         """
 
         values = []
         for field in self.to_get:
             to_append = item['_source'].get(field)
             values.append(to_append)
+        if None in values[:len(self.to_check)]:
+            # No repo (so, not tracked): nothing to normalize
+            return [None] + values[len(self.to_check):]
         values = self._normalize_values(values)
         return values
 
@@ -204,11 +291,12 @@ class Index():
                 yield to_write
             else:
                 logging.info("Project already as it should: " + project)
-            if (self.retrieved % 1000) == 0:
-                print("Retrieved: {}, updated: {}".format(self.retrieved,
-                                                            self.updated),
-                        end='\r')
-        print()
+            if (self.retrieved % self.progress_every) == 0:
+                print("{}: retrieved: {}, updated: {}".format(self.index,
+                                            self.retrieved, self.updated),
+                        end=self.progress_end)
+        if self.progress_end == '\r':
+            print()
 
     def write(self, items, projects):
         """Write items to ElasticSearch instance and index.
@@ -222,11 +310,268 @@ class Index():
         actions = self.update(items)
         elasticsearch.helpers.bulk(self.es, actions,
             max_chunk_bytes=self.max_chunk)
-        for project in sorted(self.projects_found.keys()):
-            print("Project:", project,
-                    "repos: ", self.projects_found[project])
-        print("Items retrieved:", self.retrieved)
-        print("Items updated:", self.updated)
+        lines = ["Project: {} repos: {}".format(project,
+                                            self.projects_found[project])
+                    for project in sorted(self.projects_found.keys())]
+        lines.append("Items retrieved: {}".format(self.retrieved))
+        lines.append("Items updated: {}".format(self.updated))
+        self._show_summary(lines)
+
+    def _show_summary(self, lines):
+        """Show summary of the annotation of the index.
+
+        Printed at once, so that summaries of indexes annotated
+        concurrently are not mixed.
+
+        """
+
+        print("\n".join(["Index: " + self.index] + lines))
+
+    def _normalize_repo(self, repo):
+        """Normalize a repo, as found in the to_check fields of the index.
+
+        :param repo: tuple with values of the to_check fields
+        :return:     normalized repo, as in the spreadsheet
+
+        """
+
+        values = list(repo) + [None] * len(self.to_change)
+        return self._normalize_values(values)[0]
+
+    def _repo_buckets(self):
+        """Get all (repo, project) pairs in the index.
+
+        Uses a composite aggregation on the to_check fields and the
+        project field (which may be missing, then project is None).
+
+        :return: list of (repo, project, count) tuples, repo being
+            a tuple with the values of the to_check fields, and count
+            the number of documents with that repo and project
+
+        """
+
+        sources = [{field: {'terms': {'field': field}}}
+                    for field in self.to_check]
+        sources.append({'project': {'terms': {'field': 'project',
+                                            'missing_bucket': True}}})
+        composite = {'sources': sources, 'size': COMPOSITE_SIZE}
+        repo_buckets = []
+        while True:
+            body = {'size': 0, 'aggs': {'repos': {'composite': composite}}}
+            result = self.es.search(index=self.index, body=body,
+                                    request_timeout=300)
+            buckets = result['aggregations']['repos']['buckets']
+            if not buckets:
+                break
+            for bucket in buckets:
+                repo = tuple(bucket['key'][field] for field in self.to_check)
+                repo_buckets.append((repo, bucket['key']['project'],
+                                    bucket['doc_count']))
+            composite['after'] = result['aggregations']['repos'].get(
+                                    'after_key', buckets[-1]['key'])
+        return repo_buckets
+
+    def _changes(self, projects):
+        """Find changes needed in the index, according to projects.
+
+        Joins (repo, project) pairs in the index with projects.
+
+        :param projects: dictionary with the project for each repo
+        :return: (repos, counts, unmapped) tuple:
+            repos is a dictionary with the repos (list of tuples with values
+            of the to_check fields) with documents to move to each project,
+            counts is a dictionary with the number of documents
+            to move to each project,
+            unmapped is a dictionary with the number of documents
+            for each (normalized) repo not found in projects
+
+        """
+
+        repos = {}
+        counts = {}
+        unmapped = {}
+        for (repo, current, count) in self._repo_buckets():
+            normalized = self._normalize_repo(repo)
+            if normalized in projects:
+                project = projects[normalized]
+            else:
+                project = 'Not tracked'
+                unmapped[normalized] = unmapped.get(normalized, 0) + count
+            if current != project:
+                repos.setdefault(project, set()).add(repo)
+                counts[project] = counts.get(project, 0) + count
+        repos = {project: sorted(repos[project]) for project in repos}
+        return (repos, counts, unmapped)
+
+    def _missing_query(self):
+        """Query matching documents with some to_check field missing.
+
+        Those documents have no repo, and therefore are 'Not tracked'.
+
+        """
+
+        return {'bool': {'should': [
+                    {'bool': {'must_not': [{'exists': {'field': field}}]}}
+                    for field in self.to_check],
+                'minimum_should_match': 1}}
+
+    def _repos_query(self, repos):
+        """Query matching documents for any of repos.
+
+        :param repos: list of tuples with values of the to_check fields
+
+        """
+
+        if len(self.to_check) == 1:
+            return {'terms': {self.to_check[0]: [repo[0] for repo in repos]}}
+        clauses = []
+        for repo in repos:
+            clauses.append({'bool': {'filter': [{'term': {field: value}}
+                            for (field, value) in zip(self.to_check, repo)]}})
+        return {'bool': {'should': clauses, 'minimum_should_match': 1}}
+
+    def _wait_task(self, task_id, description):
+        """Wait for a task to complete, showing progress.
+
+        :param     task_id: task to wait for
+        :param description: description of the task, for progress
+        :return:            response of the task
+
+        """
+
+        while True:
+            task = self.es.tasks.get(task_id=task_id)
+            status = task['task']['status']
+            print("{}: updated {} of {}".format(description,
+                    status['updated'], status['total']),
+                    end=self.progress_end)
+            if task.get('completed'):
+                break
+            time.sleep(TASK_POLL)
+        if self.progress_end == '\r':
+            print()
+        response = task.get('response', {})
+        if task.get('error') or response.get('failures'):
+            print("Error in {}: {}".format(description,
+                    task.get('error') or response['failures']))
+            exit()
+        return response
+
+    def _wrong_project(self, query, project):
+        """Query for documents matching query, but not in project.
+
+        """
+
+        return {'bool': {
+                    'filter': [query],
+                    'must_not': [{'term': {'project': project}}]
+                    }}
+
+    def _update_project(self, query, project):
+        """Set project for documents matching query, in ElasticSearch.
+
+        Documents already in project are not updated.
+
+        :param   query: query for documents to update
+        :param project: project to set
+        :return:        number of documents updated
+
+        """
+
+        body = {
+            'query': self._wrong_project(query, project),
+            'script': {
+                'source': 'ctx._source.project = params.project',
+                'lang': 'painless',
+                'params': {'project': project}
+                }
+            }
+        logging.debug("Update by query: {}".format(body))
+        task_id = self.es.update_by_query(index=self.index, body=body,
+                                    conflicts='proceed',
+                                    slices=self.slices or 'auto',
+                                    wait_for_completion=False)['task']
+        response = self._wait_task(task_id,
+                            "{} ({})".format(self.index, project))
+        return response['updated']
+
+    def update_by_query(self, projects, slices=None):
+        """Update project field in the index, with update_by_query.
+
+        Repos in the index with documents in the wrong project (according
+        to the spreadsheet) are grouped by the project they should be in,
+        and each group is updated with update_by_query (in chunks of
+        MAX_TERMS repos). Finally, documents with no repo are set to
+        'Not tracked'. No document is retrieved.
+
+        :param projects: dictionary with the project for each repo
+        :param   slices: slices for update_by_query (None for auto)
+
+        """
+
+        self.slices = slices
+        self.projects_found = {}
+        self.updated = 0
+        (repos_projects, counts, unmapped) = self._changes(projects)
+        for repo in sorted(unmapped.keys(), key=str):
+            logging.info("Repo not found in spreadsheet: " + str(repo))
+        for project in sorted(repos_projects.keys()):
+            for chunk in _chunks(repos_projects[project], MAX_TERMS):
+                updated = self._update_project(self._repos_query(chunk),
+                                                project)
+                self._count_updated(project, updated)
+        self._count_updated('Not tracked',
+            self._update_project(self._missing_query(), 'Not tracked'))
+        lines = ["Project: {} items updated: {}".format(project,
+                                            self.projects_found[project])
+                    for project in sorted(self.projects_found.keys())]
+        lines.append("Items updated: {}".format(self.updated))
+        self._show_summary(lines)
+
+    def dry_run(self, projects):
+        """Show changes that annotating the index would produce.
+
+        No document is retrieved or updated: changes are found
+        with an aggregation of (repo, project) pairs in the index.
+
+        :param projects: dictionary with the project for each repo
+
+        """
+
+        (repos_projects, counts, unmapped) = self._changes(projects)
+        body = {'query': self._wrong_project(self._missing_query(),
+                                            'Not tracked')}
+        missing = self.es.count(index=self.index, body=body)['count']
+        if missing > 0:
+            counts['Not tracked'] = counts.get('Not tracked', 0) + missing
+        lines = ["Project: {} items to update: {} (repos: {})".format(
+                    project, counts[project],
+                    len(repos_projects.get(project, [])))
+                    for project in sorted(counts.keys())]
+        lines.append("Items to update: {}".format(sum(counts.values())))
+        lines.append("Items with no repo to update: {}".format(missing))
+        lines.append("Repos not found in spreadsheet: {}".format(
+                        len(unmapped)))
+        lines.extend(["  {} (items: {})".format(repo, unmapped[repo])
+                        for repo in sorted(unmapped.keys(), key=str)])
+        self._show_summary(lines)
+
+    def _count_updated(self, project, updated):
+        """Count documents updated for a project.
+
+        """
+
+        if updated > 0:
+            self.projects_found[project] = \
+                self.projects_found.get(project, 0) + updated
+            self.updated += updated
+
+def _chunks(items, size):
+    """Split a list in chunks of (at most) size items.
+
+    """
+
+    return [items[start:start + size] for start in range(0, len(items), size)]
 
 class Index_Git(Index):
     """Class for git commits.
@@ -240,6 +585,7 @@ class Index_Git(Index):
 
         self.to_check = ['repo_name']
         self.to_change = ['project']
+        self.sheet = 'Github'
 
     def _normalize_values(self, values):
         """Normalize values obtained from the database.
@@ -263,6 +609,7 @@ class Index_GitHub(Index):
 
         self.to_check = ['origin']
         self.to_change = ['project']
+        self.sheet = 'Github'
 
     def _normalize_values(self, values):
         """Normalize GitHub repo names.
@@ -284,6 +631,7 @@ class Index_Bugzilla(Index):
 
         self.to_check = ['product','component']
         self.to_change = ['project']
+        self.sheet = 'Bugzilla'
 
     def _normalize_values(self, values):
         """Normalize values obtained from the database, if needed.
@@ -307,6 +655,7 @@ class Index_Email(Index):
 
         self.to_check = ['list']
         self.to_change = ['project']
+        self.sheet = 'Mailing lists'
 
 class Index_Discourse(Index):
     """Class for email messages.
@@ -320,6 +669,7 @@ class Index_Discourse(Index):
 
         self.to_check = ['category_id']
         self.to_change = ['project']
+        self.sheet = 'Discourse'
 
 
 class Sheet ():
@@ -352,48 +702,65 @@ class Sheet ():
         self.repo_columns = [0]
         self.project_column = 1
 
-    def _get_repo(self, row):
-        """Get repo from row in spreadsheet.
+    def _column(self, column):
+        """Get all values in a column (skip header).
 
         """
 
-        return self.sheet.cell(row,self.repo_columns[0]).value
+        return self.sheet.col_values(column, start_rowx=1)
 
-    def _normalize_repo(self, repo):
-        """Normalize repository name.
+    def _get_repos(self):
+        """Get repos from all rows in spreadsheet.
+
+        """
+
+        return self._normalize_repos(self._column(self.repo_columns[0]))
+
+    def _normalize_repos(self, repos):
+        """Normalize repository names.
 
         By default, nothing to do.
 
         """
 
-        return repo
+        return repos
 
     def get_repos(self, show_projects=False):
         """Get dictionary with repos pointing to their projects.
 
         """
 
-        # Read all rows with data in spreadsheet (skip header)
-        for row in range(1,self.sheet.nrows):
-            repo = self._get_repo(row)
-            repo = self._normalize_repo(repo)
-            project = self.sheet.cell(row,self.project_column).value
-            logging.info("Found in spreadsheet: {}, {}".format(repo, project))
-            if project == '':
-                project = 'Unknown'
-            self.projects[repo] = project
-            if project in self.repos:
-                self.repos[project] += 1
-            else:
-                self.repos[project] = 1
+        # Read all rows with data in spreadsheet, by columns
+        repos = self._get_repos()
+        projects = [project if project != '' else 'Unknown'
+                    for project in self._column(self.project_column)]
+        if logging.getLogger().isEnabledFor(logging.DEBUG):
+            for (repo, project) in zip(repos, projects):
+                logging.debug("Found in spreadsheet: {}, {}".format(repo,
+                                                                    project))
+        self.projects.update(zip(repos, projects))
+        for project in projects:
+            self.repos[project] = self.repos.get(project, 0) + 1
+        logging.info("Sheet {}: {} repos".format(self.sheet.name,
+                                                len(self.projects)))
         if show_projects:
-            print("Analyzed sheet " + self.sheet.name)
-            print("Repos found in spreadsheet (per project)")
-            for project in sorted(self.repos.keys()):
-                print("Project:", project, "repos: ",
-                    self.repos[project])
+            print_projects(self.sheet.name, self.repos)
         return self.projects
 
+def print_projects(sheet_name, repos):
+    """Print number of repos per project.
+
+    :param sheet_name: name of the sheet
+    :param      repos: dictionary with number of repos for each project
+
+    """
+
+    print("Analyzed sheet " + sheet_name)
+    print("Repos found in spreadsheet (per project)")
+    for project in sorted(repos.keys()):
+        print("Project:", project, "repos: ",
+            repos[project])
+
 def normalized_ghrepo(repo):
     """Repos come in several ways, they need to be normalized.
 
@@ -429,9 +796,9 @@ class GitHubSheet (Sheet):
 
     """
 
-    def _normalize_repo(self, repo):
+    def _normalize_repos(self, repos):
 
-        return normalized_ghrepo(repo)
+        return [normalized_ghrepo(repo) for repo in repos]
 
 class BugzillaSheet (Sheet):
     """Deal with Bugzilla sheet.
@@ -447,14 +814,15 @@ class BugzillaSheet (Sheet):
         self.repo_columns = [1,2]
         self.project_column = 3
 
-    def _get_repo(self, row):
-        """Get repo from row in spreadsheet.
+    def _get_repos(self):
+        """Get repos from all rows in spreadsheet.
 
         """
 
-        product = self.sheet.cell(row,self.repo_columns[0]).value
-        component = self.sheet.cell(row,self.repo_columns[1]).value
-        return normalized_bzrepo(product, component)
+        products = self._column(self.repo_columns[0])
+        components = self._column(self.repo_columns[1])
+        return [normalized_bzrepo(product, component)
+                for (product, component) in zip(products, components)]
 
 class EmailSheet (Sheet):
     """Deal with Email sheet.
@@ -480,17 +848,101 @@ class DiscourseSheet (Sheet):
         self.repo_columns = [1]
         self.project_column = 2
 
-#    def _normalize_repo(self, repo):
+#    def _normalize_repos(self, repos):
 #        """Repos may start with '-> '
 #
 #        Remove '-> ' when that's in the category name.
 #
-#        :param repo: repo to normalize
+#        :param repos: repos to normalize
 #
 #        """
 
-#        normalized = repo.replace('-> ','',1)
-#        return normalized
+#        return [repo.replace('-> ','',1) for repo in repos]
+
+# Classes to deal with each sheet in the spreadsheet, by sheet name
+SHEET_CLASSES = {'Github': GitHubSheet,
+                'Bugzilla': BugzillaSheet,
+                'Mailing lists': EmailSheet,
+                'Discourse': DiscourseSheet}
+
+def file_hash(filepath):
+    """Get SHA-256 hash (hex digest) of the contents of a file.
+
+    """
+
+    sha = hashlib.sha256()
+    with open(filepath, 'rb') as f:
+        for block in iter(lambda: f.read(1 << 20), b''):
+            sha.update(block)
+    return sha.hexdigest()
+
+def read_projects(filepath, show_projects=False):
+    """Read projects from all known sheets in the spreadsheet.
+
+    :param      filepath: path of the spreadsheet
+    :param show_projects: show projects found in each sheet
+    :return: dictionary with the projects for each sheet (key is
+        sheet name, value is dictionary with the project for each repo)
+
+    """
+
+    wb = open_workbook(filepath)
+    sheets_projects = {}
+    for sheet in wb.sheets():
+        if sheet.name in SHEET_CLASSES:
+            sheet_obj = SHEET_CLASSES[sheet.name](sheet)
+            sheets_projects[sheet.name] = sheet_obj.get_repos(
+                    show_projects = show_projects)
+    return sheets_projects
+
+def load_projects(filepath, compiled=None, show_projects=False):
+    """Load projects from the spreadsheet, or from a compiled file.
+
+    The compiled file is a JSON document with the projects in each sheet
+    (as a list of [repo, project] pairs, so that repos which are
+    not strings are kept as such), and the SHA-256 hash of the
+    spreadsheet it was compiled from. If the compiled file does
+    not exist, or was compiled from a different spreadsheet,
+    the spreadsheet is read, and the compiled file is written.
+
+    :param      filepath: path of the spreadsheet
+    :param      compiled: path of the compiled file (None for no file)
+    :param show_projects: show projects found in each sheet
+    :return: dictionary with the projects for each sheet
+
+    """
+
+    if compiled is None:
+        return read_projects(filepath, show_projects)
+    digest = file_hash(filepath)
+    try:
+        with open(compiled, 'r') as f:
+            data = json.load(f)
+        if data['sha256'] == digest:
+            logging.info("Projects loaded from compiled file " + compiled)
+            sheets_projects = {}
+            for (sheet_name, pairs) in data['sheets'].items():
+                projects = {repo: project for (repo, project) in pairs}
+                if show_projects:
+                    repos = {}
+                    for project in projects.values():
+                        repos[project] = repos.get(project, 0) + 1
+                    print_projects(sheet_name, repos)
+                sheets_projects[sheet_name] = projects
+            return sheets_projects
+    except (OSError, ValueError, KeyError):
+        pass
+    sheets_projects = read_projects(filepath, show_projects)
+    data = {'spreadsheet': os.path.basename(filepath),
+            'sha256': digest,
+            'sheets': {sheet_name: list(projects.items())
+                        for (sheet_name, projects) in sheets_projects.items()}}
+    tmp_path = compiled + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump(data, f)
+    os.replace(tmp_path, compiled)
+    logging.info("Projects compiled to " + compiled)
+    return sheets_projects
 
 
 def main():
@@ -507,49 +959,47 @@ def main():
         else:
             logging.basicConfig(format=log_format, level=level)
 
-    if args.projects:
-        wb = open_workbook('projects.xlsx')
-        for sheet in wb.sheets():
-            if (sheet.name == 'Github') and \
-                (args.index_git or args.index_github):
-                sheet_obj = GitHubSheet(sheet)
-                repos_projects = sheet_obj.get_repos(
-                        show_projects = args.show_projects)
-            elif (sheet.name == "Bugzilla") and args.index_bugzilla:
-                sheet_obj = BugzillaSheet(sheet)
-                repos_projects = sheet_obj.get_repos(
-                        show_projects = args.show_projects)
-            elif (sheet.name == "Mailing lists") and args.index_email:
-                sheet_obj = EmailSheet(sheet)
-                repos_projects = sheet_obj.get_repos(
-                        show_projects = args.show_projects)
-            elif (sheet.name == "Discourse") and args.index_discourse:
-                sheet_obj = DiscourseSheet(sheet)
-                repos_projects = sheet_obj.get_repos(
-                        show_projects = args.show_projects)
-
     index_args = {'instance': args.es,
         'scroll_period': args.scroll_period,
         'max_chunk': args.max_chunk,
         'verify_certs': args.verify_certs}
-    indexes = []
-    if args.index_git:
-        indexes.append(Index_Git(index=args.index_git,
-                                **index_args))
-    if args.index_github:
-        indexes.append(Index_GitHub(index=args.index_github,
-                        **index_args))
-    if args.index_bugzilla:
-        indexes.append(Index_Bugzilla(index=args.index_bugzilla,
-                        **index_args))
-    if args.index_email:
-        indexes.append(Index_Email(index=args.index_email,
-                        **index_args))
-    if args.index_discourse:
-        indexes.append(Index_Discourse(index=args.index_discourse,
-                        **index_args))
+    selected = [(Index_Git, args.index_git),
+                (Index_GitHub, args.index_github),
+                (Index_Bugzilla, args.index_bugzilla),
+                (Index_Email, args.index_email),
+                (Index_Discourse, args.index_discourse)]
+    selected = [(index_class, index) for (index_class, index) in selected
+                if index]
+    index_args['progress_lines'] = (len(selected) > 1) and (args.workers > 1)
+    indexes = [index_class(index=index, **index_args)
+                for (index_class, index) in selected]
+
+    # Projects for each sheet (key is sheet name, value is dictionary
+    # with the project for each repo)
+    sheets_projects = {}
+    if args.projects:
+        sheets_projects = load_projects(args.projects,
+                                        compiled=args.compiled,
+                                        show_projects=args.show_projects)
     for index in indexes:
-        index.write(index.read(), repos_projects)
+        if index.sheet not in sheets_projects:
+            print("No sheet {} with projects for index {}.".format(
+                index.sheet, index.index))
+            exit()
+
+    def annotate(index):
+        repos_projects = sheets_projects[index.sheet]
+        if args.dry_run:
+            index.dry_run(repos_projects)
+        elif args.update_by_query:
+            index.update_by_query(repos_projects, slices=args.slices)
+        else:
+            index.write(index.read(repos_projects), repos_projects)
+
+    with ThreadPoolExecutor(max_workers=max(args.workers, 1)) as executor:
+        futures = [executor.submit(annotate, index) for index in indexes]
+        for future in futures:
+            future.result()
 
 if __name__ == "__main__":
     main()
@@ -1,30 +1,16 @@
 
-import certifi
-import configparser
-
 import pandas as pd
 
-from elasticsearch import Elasticsearch
 from elasticsearch_dsl import Search
 
-def ESConnection():
-
-    parser = configparser.ConfigParser()
-    parser.read('.settings')
-
-    section = parser['ElasticSearch']
-    user = section['user']
-    password = section['password']
-    host = section['host']
-    port = section['port']
-    path = section['path']
-
-    connection = "https://" + user + ":" + password + "@" + host + ":" + port + "/" + path
-
-    es_read = Elasticsearch([connection], use_ssl=True, verity_certs=True, ca_cert=certifi.where(), scroll='300m',
-	timeout=1000)
+import es_connection
+import query_cache
 
-    return es_read
+# ES connection and on-disk cache for query results (shared with
+# the notebooks in rc1)
+ESConnection = es_connection.ESConnection
+cached_execute = query_cache.cached_execute
+invalidate_cache = query_cache.invalidate_cache
 
 
 def to_df_by_time(result, group_column, time_column, value_column,subgroup_column,